@@ -1,128 +1,228 @@
+import asyncio
+import csv
+import io
+import time
+from typing import Dict, List
+
 import discord
 from discord.ext import commands
 
 from config.config_manager import BaseConfigManager
+from metrics import labelled, labels_of, metrics, split_name
+from outbox import EMBED_DESCRIPTION_LIMIT, Outbox
 
 
 class AdministrationCommands(commands.Cog):
-    def __init__(self, bot, configMgr: BaseConfigManager):
+    def __init__(self, bot, configMgr: BaseConfigManager, bulkConcurrency: int = 5, outbox: Outbox = None):
         self.bot = bot
         self.configManager = configMgr
+        self.bulkConcurrency = bulkConcurrency
+        # Replies go through a per-channel queue so bursts are coalesced.
+        self.outbox = outbox if outbox is not None else Outbox()
+        # Member requests in flight, so concurrent commands share one.
+        self._chunking: Dict[int, asyncio.Task] = {}
 
     @commands.command()
     @commands.guild_only()
     async def addRole(self, ctx, role: discord.Role, member: discord.Member):
         """Adds a Role to a user: !addRole <Role> <User>"""
-        if not (
-            self.configManager.isCommander(ctx.guild, role, ctx.author) or
-            (
-                ctx.author.guild_permissions.manage_roles and
-                ctx.author.top_role.position >= role.position
-            )
-        ):
-            await ctx.send("You don't have permission to add users to roles!")
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
             return
         await member.add_roles(role, reason='Added by ' + ctx.author.name)
-        await ctx.send('Added ' + member.name + ' to @' + role.name)
+        await self.__send(ctx, 'Added ' + member.name + ' to @' + role.name)
 
     @addRole.error
     async def addRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !addRole <role> <user>')
+                await self.__send(ctx, 'Invalid Role! Usage: !addRole <role> <user>')
             if 'Member ' in error.args[0]:
-                await ctx.send('Invalid Member! Usage: !addRole <role> <user>')
+                await self.__send(ctx, 'Invalid Member! Usage: !addRole <role> <user>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !addRole <role> <user>')
+            await self.__send(ctx, 'ERROR! Usage: !addRole <role> <user>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
     async def joinRole(self, ctx, role: discord.Role):
         """Joins a Joinable Role: !joinRole <role>"""
         if not self.configManager.isJoinableRole(ctx.guild, role):
-            await ctx.send('@' + role.name + ' isn\'t joinable.')
+            await self.__send(ctx, '@' + role.name + ' isn\'t joinable.')
             return
         await ctx.author.add_roles(role, reason='Adding to Joinable Role by ' + ctx.author.name)
-        await ctx.send('Joined @' + role.name)
+        await self.__send(ctx, 'Joined @' + role.name)
 
     @joinRole.error
     async def joinRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !joinRole <role>')
+                await self.__send(ctx, 'Invalid Role! Usage: !joinRole <role>')
             elif isinstance(error, commands.MissingRequiredArgument):
-                await ctx.send('ERROR! Usage: !joinRole <role>')
+                await self.__send(ctx, 'ERROR! Usage: !joinRole <role>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
     async def remRole(self, ctx, role: discord.Role, member: discord.Member):
         """Removes a Role from a user: !remRole <Role> <User>"""
-        if not (
-            self.configManager.isCommander(ctx.guild, role, ctx.author) or
-            (
-                ctx.author.guild_permissions.manage_roles and
-                ctx.author.top_role.position >= role.position
-            )
-        ):
-            await ctx.send("You don't have permission to add users to roles!")
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
             return
         await member.remove_roles(role, reason='Removed by ' + ctx.author.name)
-        await ctx.send('Removed ' + member.name + ' from @' + role.name)
+        await self.__send(ctx, 'Removed ' + member.name + ' from @' + role.name)
 
     @remRole.error
     async def remRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !remRole <role> <user>')
+                await self.__send(ctx, 'Invalid Role! Usage: !remRole <role> <user>')
             elif 'Member ' in error.args[0]:
-                await ctx.send('Invalid Member! Usage: !remRole <role> <user>')
+                await self.__send(ctx, 'Invalid Member! Usage: !remRole <role> <user>')
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await self.__send(ctx, 'ERROR! Usage: !remRole <role> <user>')
+        else:
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    async def addRoleMany(self, ctx, role: discord.Role, *members: discord.Member):
+        """Adds a Role to several users: !addRoleMany <Role> <User> [User...]"""
+        if len(members) == 0:
+            raise commands.MissingRequiredArgument(ctx.command.clean_params['members'])
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
+            return
+        await self.__bulkUpdateRole(ctx, role, members, True)
+
+    @addRoleMany.error
+    async def addRoleMany_error(self, ctx, error):
+        # Every user is converted before any role changes, so one bad user
+        # stops the whole command.
+        if isinstance(error, commands.BadArgument):
+            if 'Member ' in error.args[0]:
+                await self.__send(ctx, 'Invalid Member! ' + error.args[0] +
+                                  ' No roles were changed. Usage: !addRoleMany <role> <user> [user...]')
+            else:
+                await self.__send(ctx, 'Invalid Role! Usage: !addRoleMany <role> <user> [user...]')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !remRole <role> <user>')
+            await self.__send(ctx, 'ERROR! Usage: !addRoleMany <role> <user> [user...]')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    async def remRoleMany(self, ctx, role: discord.Role, *members: discord.Member):
+        """Removes a Role from several users: !remRoleMany <Role> <User> [User...]"""
+        if len(members) == 0:
+            raise commands.MissingRequiredArgument(ctx.command.clean_params['members'])
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
+            return
+        await self.__bulkUpdateRole(ctx, role, members, False)
+
+    @remRoleMany.error
+    async def remRoleMany_error(self, ctx, error):
+        # Every user is converted before any role changes, so one bad user
+        # stops the whole command.
+        if isinstance(error, commands.BadArgument):
+            if 'Member ' in error.args[0]:
+                await self.__send(ctx, 'Invalid Member! ' + error.args[0] +
+                                  ' No roles were changed. Usage: !remRoleMany <role> <user> [user...]')
+            else:
+                await self.__send(ctx, 'Invalid Role! Usage: !remRoleMany <role> <user> [user...]')
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await self.__send(ctx, 'ERROR! Usage: !remRoleMany <role> <user> [user...]')
+        else:
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    async def addRoleByRole(self, ctx, role: discord.Role, withRole: discord.Role):
+        """Adds a Role to everyone with another Role: !addRoleByRole <Role> <WithRole>"""
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
+            return
+        await self.__loadAllMembers(ctx.guild)
+        await self.__bulkUpdateRole(ctx, role, withRole.members, True)
+
+    @addRoleByRole.error
+    async def addRoleByRole_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await self.__send(ctx, 'Invalid Role! Usage: !addRoleByRole <role> <withRole>')
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await self.__send(ctx, 'ERROR! Usage: !addRoleByRole <role> <withRole>')
+        else:
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    async def remRoleByRole(self, ctx, role: discord.Role, withRole: discord.Role):
+        """Removes a Role from everyone with another Role: !remRoleByRole <Role> <WithRole>"""
+        if not self.__canManageRole(ctx, role):
+            await self.__send(ctx, "You don't have permission to add users to roles!")
+            return
+        await self.__loadAllMembers(ctx.guild)
+        await self.__bulkUpdateRole(ctx, role, withRole.members, False)
+
+    @remRoleByRole.error
+    async def remRoleByRole_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await self.__send(ctx, 'Invalid Role! Usage: !remRoleByRole <role> <withRole>')
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await self.__send(ctx, 'ERROR! Usage: !remRoleByRole <role> <withRole>')
+        else:
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
     async def leaveRole(self, ctx, role: discord.Role):
         """Leaves a Joinable Role: !leaveRole <role>"""
         if not self.configManager.isJoinableRole(ctx.guild, role):
-            await ctx.send('@' + role.name + ' isn\'t joinable.')
+            await self.__send(ctx, '@' + role.name + ' isn\'t joinable.')
             return
         await ctx.author.remove_roles(role, reason='Leaving a Joinable Role by ' + ctx.author.name)
-        await ctx.send('Left @' + role.name)
+        await self.__send(ctx, 'Left @' + role.name)
 
     @leaveRole.error
     async def leaveRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !leaveRole <role>')
+                await self.__send(ctx, 'Invalid Role! Usage: !leaveRole <role>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !leaveRole <role>')
+            await self.__send(ctx, 'ERROR! Usage: !leaveRole <role>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
     async def listJoinableRoles(self, ctx):
         """Lists all Joinable roles: !listJoinableRoles"""
-        joinableRoles = self.configManager.getJoinableRoles(ctx.guild)
-        output = 'Joinable Roles:\n'
-        if len(joinableRoles) == 0:
-            output += 'None'
-        else:
-            for roleId in joinableRoles:
-                role = None
-                for guildRole in ctx.guild.roles:
-                    if guildRole.id == roleId:
-                        role = guildRole
-                        break
-                if role is not None:
-                    output += role.name + '\n'
-        await ctx.send(output)
+        roles = []
+        for roleId in self.configManager.getJoinableRoles(ctx.guild):
+            role = ctx.guild.get_role(roleId)
+            if role is not None:
+                roles.append(role)
+        # Highest first, as in Discord's own role list.
+        roles.sort(key=lambda role: role.position, reverse=True)
+
+        # Split the list over as many embeds as it needs.
+        pages = ['']
+        for role in roles:
+            line = role.name + '\n'
+            if len(pages[-1]) + len(line) > EMBED_DESCRIPTION_LIMIT:
+                pages.append('')
+            pages[-1] += line
+        if len(roles) == 0:
+            pages[0] = 'None'
+
+        for iPage, page in enumerate(pages):
+            embed = discord.Embed(title='Joinable Roles', description=page)
+            if len(pages) > 1:
+                embed.set_footer(text='Page ' + str(iPage + 1) + ' of ' + str(len(pages)))
+            await self.outbox.send(ctx.channel, embed=embed)
 
     @commands.command()
     @commands.guild_only()
@@ -130,20 +230,19 @@ class AdministrationCommands(commands.Cog):
     async def addRoleMgr(self, ctx, role: discord.Role, member: discord.Member):
         """Adds a RoleManager to a Role: !addRoleMgr <Role> <User>"""
         self.configManager.addCommander(ctx.guild, role, member)
-        self.configManager.writeConfig()
-        await ctx.send(member.name + ' can now add users to ' + role.name)
+        await self.__send(ctx, member.name + ' can now add users to ' + role.name)
 
     @addRoleMgr.error
     async def addRoleMgr_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !addRoleMgr <role> <user>')
+                await self.__send(ctx, 'Invalid Role! Usage: !addRoleMgr <role> <user>')
             elif 'Member ' in error.args[0]:
-                await ctx.send('Invalid Member! Usage: !addRoleMgr <role> <user>')
+                await self.__send(ctx, 'Invalid Member! Usage: !addRoleMgr <role> <user>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !addRoleMgr <role> <user>')
+            await self.__send(ctx, 'ERROR! Usage: !addRoleMgr <role> <user>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -151,20 +250,42 @@ class AdministrationCommands(commands.Cog):
     async def remRoleMgr(self, ctx, role: discord.Role, member: discord.Member):
         """Removes a RoleManager from a Role: !remRoleMgr <Role> <User>"""
         self.configManager.remCommander(ctx.guild, role, member)
-        self.configManager.writeConfig()
-        await ctx.send(member.name + ' can no longer add users to ' + role.name)
+        await self.__send(ctx, member.name + ' can no longer add users to ' + role.name)
 
     @remRoleMgr.error
     async def remRoleMgr_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             if 'Role ' in error.args[0]:
-                await ctx.send('Invalid Role! Usage: !remRoleMgr <role> <user>')
+                await self.__send(ctx, 'Invalid Role! Usage: !remRoleMgr <role> <user>')
             elif 'Member ' in error.args[0]:
-                await ctx.send('Invalid Member! Usage: !remRoleMgr <role> <user>')
+                await self.__send(ctx, 'Invalid Member! Usage: !remRoleMgr <role> <user>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !remRoleMgr <role> <user>')
+            await self.__send(ctx, 'ERROR! Usage: !remRoleMgr <role> <user>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    async def listManagedRoles(self, ctx, member: discord.Member = None):
+        """Lists the Roles a user can add members to: !listManagedRoles [User]"""
+        member = member if member is not None else ctx.author
+        output = 'Roles managed by ' + member.name + ':\n'
+
+        roleNames = []
+        for roleId in self.configManager.getCommandedRoles(ctx.guild, member):
+            role = ctx.guild.get_role(roleId)
+            if role is not None:
+                roleNames.append(role.name)
+
+        output += '\n'.join(roleNames) if len(roleNames) > 0 else 'None'
+        await self.__send(ctx, output)
+
+    @listManagedRoles.error
+    async def listManagedRoles_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await self.__send(ctx, 'Invalid Member! Usage: !listManagedRoles [user]')
+        else:
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -176,21 +297,22 @@ class AdministrationCommands(commands.Cog):
         output += 'Joinable Group: ' + \
             str(self.configManager.isJoinableRole(ctx.guild, role)) + '\n'
 
+        await self.__loadMembers(ctx.guild, self.configManager.getCommanders(ctx.guild, role))
         commanders = self.configManager.listCommanders(ctx.guild, role)
         if len(commanders) < 1:
             commanders = 'None'
         output += 'Managers for @' + role.name + ':\n' + commanders
 
-        await ctx.send(output)
+        await self.__send(ctx, output)
 
     @listRoleData.error
     async def listRoleData_error(self, ctx, error):
         if isinstance(error,  commands.BadArgument):
-            await ctx.send('Invalid Role! Usage: !listRoleData <role>')
+            await self.__send(ctx, 'Invalid Role! Usage: !listRoleData <role>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !listRoleData <role>')
+            await self.__send(ctx, 'ERROR! Usage: !listRoleData <role>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -199,17 +321,16 @@ class AdministrationCommands(commands.Cog):
         """Makes a role Joinable by any user"""
         joinable = self.configManager.isJoinableRole(ctx.guild, role)
         self.configManager.setJoinableRole(ctx.guild, role, not joinable)
-        self.configManager.writeConfig()
-        await ctx.send('Joinable Group for @' + role.name + ' set to ' + str(not joinable))
+        await self.__send(ctx, 'Joinable Group for @' + role.name + ' set to ' + str(not joinable))
 
     @toggleJoinableRole.error
     async def toggleJoinableRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid Role! Usage: !toggleJoinableRole <role>')
+            await self.__send(ctx, 'Invalid Role! Usage: !toggleJoinableRole <role>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !toggleJoinableRole <role>')
+            await self.__send(ctx, 'ERROR! Usage: !toggleJoinableRole <role>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -217,15 +338,18 @@ class AdministrationCommands(commands.Cog):
     async def setGreetingMessage(self, ctx, *, greetingMessage: str):
         """Sets the Greeting Message sent to all new members of the Server (set to 'none' to disable)"""
         self.configManager.setGreetingMessage(ctx.guild,  greetingMessage)
-        self.configManager.writeConfig()
-        await ctx.send('New Greeting Message Set!')
+        await self.__send(ctx, 'New Greeting Message Set!')
 
     @commands.command()
     @commands.guild_only()
     @commands.has_permissions(administrator=True)
     async def getGreetingMessage(self,  ctx):
         """Shows the Greeting Message sent to all new members of the server (if 'none' no message will be sent)"""
-        await ctx.send(self.configManager.getGreetingMessage(ctx.guild))
+        greeting = self.configManager.getGreetingMessage(ctx.guild)
+        if greeting is None:
+            await self.__send(ctx, 'No Greeting Message Set.')
+        else:
+            await self.__send(ctx, greeting)
 
     @commands.command()
     @commands.guild_only()
@@ -242,7 +366,7 @@ class AdministrationCommands(commands.Cog):
         output += 'Gate Role:' + gateRoleName + '\n'
         output += 'Gate Allows Rejoin: ' + str(gateData.allow_rejoin) + '\n'
 
-        await ctx.send(output)
+        await self.__send(ctx, output)
 
     @commands.command()
     @commands.guild_only()
@@ -254,21 +378,20 @@ class AdministrationCommands(commands.Cog):
         gateRole = guild.get_role(gateData.key_role_id)
 
         if gated and gateRole is None:
-            await ctx.send('ERROR: Cannot set Gate Enabled when no Gate Role is defined!')
+            await self.__send(ctx, 'ERROR: Cannot set Gate Enabled when no Gate Role is defined!')
         else:
             self.configManager.setGateData(
                 guild, gated, gateData.allow_rejoin, gateData.key_role_id, gateData.keyed_users)
-            self.configManager.writeConfig()
-            await ctx.send('Gate Enabled Set: ' + str(gated))
+            await self.__send(ctx, 'Gate Enabled Set: ' + str(gated))
 
     @setGateEnabled.error
     async def setGateEnabled_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid Entry! Usage: !setGateEnabled <True/False>')
+            await self.__send(ctx, 'Invalid Entry! Usage: !setGateEnabled <True/False>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !setGateEnabled <true/false>')
+            await self.__send(ctx, 'ERROR! Usage: !setGateEnabled <true/false>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -280,17 +403,16 @@ class AdministrationCommands(commands.Cog):
 
         self.configManager.setGateData(
             guild, gateData.gate_enabled, gateData.allow_rejoin, role.id, gateData.keyed_users)
-        self.configManager.writeConfig()
-        await ctx.send("Setting Gated Role: @" + role.name)
+        await self.__send(ctx, "Setting Gated Role: @" + role.name)
 
     @setGateRole.error
     async def setGateRole_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid Role! Usage: !setGateRole <role>')
+            await self.__send(ctx, 'Invalid Role! Usage: !setGateRole <role>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !setGateRole <role>')
+            await self.__send(ctx, 'ERROR! Usage: !setGateRole <role>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -302,23 +424,22 @@ class AdministrationCommands(commands.Cog):
         gateRole = guild.get_role(gateData.key_role_id)
 
         if rejoin and gateRole is None:
-            await ctx.send('ERROR: Cannot set Gate Rejoin when no Gate Role is defined!')
+            await self.__send(ctx, 'ERROR: Cannot set Gate Rejoin when no Gate Role is defined!')
         elif rejoin and not gateData.gate_enabled:
-            await ctx.send('ERROR: Cannot set Gate Rejoin when Gate is not Enabled!')
+            await self.__send(ctx, 'ERROR: Cannot set Gate Rejoin when Gate is not Enabled!')
         else:
             self.configManager.setGateData(
                 guild, True, rejoin, gateData.key_role_id, gateData.keyed_users)
-            self.configManager.writeConfig()
-            await ctx.send('Gate Enabled Set: ' + str(rejoin))
+            await self.__send(ctx, 'Gate Enabled Set: ' + str(rejoin))
 
     @setGateRejoin.error
     async def setGateRejoin_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid Entry! Usage: !setGateRejoin <True/False>')
+            await self.__send(ctx, 'Invalid Entry! Usage: !setGateRejoin <True/False>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !setGateRejoin <true/false>')
+            await self.__send(ctx, 'ERROR! Usage: !setGateRejoin <true/false>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -326,27 +447,26 @@ class AdministrationCommands(commands.Cog):
     async def getMemberData(self, ctx, member: discord.Member):
         """Gets Account Data for a Guild Member"""
         guild = ctx.guild
-        gateData = self.configManager.getGateData(guild)
 
         output = 'Account Data For User: ' + member.name + '#' + \
             member.discriminator + ' (' + str(member.id) + ')\n'
         output += 'Server Nickname: ' + member.display_name + '\n'
 
-        forumAcct = gateData.keyed_users.get(member.id)
+        forumAcct = self.configManager.getForumAccount(guild, member)
 
         if forumAcct is not None:
-            output += 'Forum Account: https://forums.europeians.com/index.php/members/' + forumAcct
+            output += 'Forum Account: https://forums.europeians.com/index.php/members/' + str(forumAcct)
 
-        await ctx.send(output)
+        await self.__send(ctx, output)
 
     @getMemberData.error
     async def getMemberData_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid User! Usage: !getMemberData <user>')
+            await self.__send(ctx, 'Invalid User! Usage: !getMemberData <user>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !getMemberData <user>')
+            await self.__send(ctx, 'ERROR! Usage: !getMemberData <user>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -357,30 +477,33 @@ class AdministrationCommands(commands.Cog):
         gateData = self.configManager.getGateData(guild)
 
         if not gateData.gate_enabled:
-            await ctx.send('ERROR! Gate Enabled must be set to True before users can be registered.')
+            await self.__send(ctx, 'ERROR! Gate Enabled must be set to True before users can be registered.')
             return
 
         gateRole = guild.get_role(gateData.key_role_id)
 
         if gateRole is None:
-            await ctx.send('ERROR! A valid Gate Role must be set before users can be registered.')
+            await self.__send(ctx, 'ERROR! A valid Gate Role must be set before users can be registered.')
             return
 
-        gateData.keyed_users[member.id] = forumAccount
-        self.configManager.setGateData(
-            guild, True, gateData.allow_rejoin, gateData.key_role_id, gateData.keyed_users)
-        self.configManager.writeConfig()
+        self.configManager.registerMember(guild, member, forumAccount)
         await member.add_roles(gateRole, reason='User Registered by ' + ctx.author.name)
-        await ctx.send('User ' + str(member.id) + ' registered to forum account: https://forums.europeians.com/index.php/members/' + str(forumAccount))
+        await self.__send(ctx, 'User ' + str(member.id) + ' registered to forum account: https://forums.europeians.com/index.php/members/' + str(forumAccount))
+
+        others = [memberId for memberId in self.configManager.getRegisteredMembers(guild, forumAccount)
+                  if memberId != member.id]
+        if len(others) > 0:
+            await self.__send(ctx, 'Note: this forum account is also registered to ' +
+                              ', '.join(self.__formatMemberId(guild, memberId) for memberId in others))
 
     @registerMember.error
     async def registerMember_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid User! Usage: !registerMember <user> <forumID>')
+            await self.__send(ctx, 'Invalid User! Usage: !registerMember <user> <forumID>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !registerMember <user> <forumID>')
+            await self.__send(ctx, 'ERROR! Usage: !registerMember <user> <forumID>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
 
     @commands.command()
     @commands.guild_only()
@@ -390,26 +513,154 @@ class AdministrationCommands(commands.Cog):
         guild = ctx.guild
         gateData = self.configManager.getGateData(guild)
 
-        if gateData.keyed_users[member.id] is not None:
-            del gateData.keyed_users[member.id]
-            self.configManager.setGateData(
-                guild, gateData.gate_enabled, gateData.allow_rejoin, gateData.key_role_id, gateData.keyed_users)
-            self.configManager.writeConfig()
-
+        if self.configManager.unregisterMember(guild, member):
             gateRole = guild.get_role(gateData.key_role_id)
             if gateRole is not None:
                 await member.remove_roles(gateRole, reason='Unregistered by ' + ctx.author.name)
 
-        await ctx.send('Unregistered Member ' + member.name + '#' + member.discriminator)
+        await self.__send(ctx, 'Unregistered Member ' + member.name + '#' + member.discriminator)
 
     @unregisterMember.error
     async def unregisterMember_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
-            await ctx.send('Invalid User! Usage: !unregisterMember <user>')
+            await self.__send(ctx, 'Invalid User! Usage: !unregisterMember <user>')
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await self.__send(ctx, 'ERROR! Usage: !unregisterMember <user>')
+        else:
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def getForumMembers(self, ctx, forumAccount: int):
+        """Lists the Guild Members registered to a forum account: !getForumMembers <forumID>"""
+        memberIds = self.configManager.getRegisteredMembers(ctx.guild, forumAccount)
+        output = 'Members registered to forum account ' + str(forumAccount) + ':\n'
+        if len(memberIds) == 0:
+            output += 'None'
+        for memberId in memberIds:
+            output += self.__formatMemberId(ctx.guild, memberId) + '\n'
+        await self.__send(ctx, output)
+
+    @getForumMembers.error
+    async def getForumMembers_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await self.__send(ctx, 'Invalid Forum ID! Usage: !getForumMembers <forumID>')
         elif isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send('ERROR! Usage: !unregisterMember <user>')
+            await self.__send(ctx, 'ERROR! Usage: !getForumMembers <forumID>')
         else:
-            await ctx.send(error.args[0])
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def listDuplicateRegistrations(self, ctx):
+        """Lists forum accounts registered to more than one Guild Member"""
+        duplicates = self.configManager.getDuplicateRegistrations(ctx.guild)
+        output = 'Forum accounts with more than one member:\n'
+        if len(duplicates) == 0:
+            output += 'None'
+        for forumAccount, memberIds in duplicates.items():
+            output += str(forumAccount) + ': ' + \
+                ', '.join(self.__formatMemberId(ctx.guild, memberId) for memberId in memberIds) + '\n'
+        await self.__send(ctx, output)
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def exportRegistrations(self, ctx):
+        """Exports all forum account registrations as a CSV file"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['member_id', 'forum_account'])
+        for memberId, forumAccount in self.configManager.getGateData(ctx.guild).keyed_users.items():
+            writer.writerow([memberId, forumAccount])
+        data = io.BytesIO(output.getvalue().encode('utf-8'))
+        await self.outbox.send(ctx.channel, file=discord.File(data, 'registrations-' + str(ctx.guild.id) + '.csv'))
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def importRegistrations(self, ctx):
+        """Imports forum account registrations from an attached CSV of member_id,forum_account rows"""
+        if len(ctx.message.attachments) == 0:
+            await self.__send(ctx, 'ERROR! Attach a CSV file of member_id,forum_account rows.')
+            return
+
+        text = (await ctx.message.attachments[0].read()).decode('utf-8-sig')
+        registrations = {}
+        skipped = 0
+        for row in csv.reader(io.StringIO(text)):
+            if len(row) < 2 or not row[0].strip().isdigit() or not row[1].strip().isdigit():
+                # Header, blank or malformed line
+                skipped += 1
+                continue
+            registrations[int(row[0])] = int(row[1])
+
+        self.configManager.importRegistrations(ctx.guild, registrations)
+        duplicates = self.configManager.getDuplicateRegistrations(ctx.guild)
+        await self.__send(ctx, 'Imported ' + str(len(registrations)) + ' registrations (' + str(skipped) +
+                          ' lines skipped). ' + str(len(duplicates)) + ' forum accounts have more than one member.')
+
+    @importRegistrations.error
+    async def importRegistrations_error(self, ctx, error):
+        if isinstance(error, commands.CommandInvokeError) and isinstance(error.original, UnicodeDecodeError):
+            await self.__send(ctx, 'ERROR! The attachment must be a UTF-8 CSV file.')
+        else:
+            await self.__send(ctx, error.args[0])
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        """Shows bot performance statistics"""
+        uptime = int(time.time() - metrics.started)
+        output = 'Uptime: ' + str(uptime // 3600) + 'h ' + str(uptime % 3600 // 60) + 'm\n'
+        output += 'Gateway Latency: ' + self.__formatMs(self.bot.latency) + '\n'
+        if 'loop_lag' in metrics.timings:
+            lag = metrics.timings['loop_lag']
+            output += 'Loop Lag: p99 <= ' + self.__formatMs(lag.quantile(0.99)) + \
+                ', max ' + self.__formatMs(lag.max) + '\n'
+        output += 'Messages: ' + str(metrics.counters.get('messages_seen', 0)) + ' seen, ' + \
+            str(metrics.counters.get('messages_dispatched', 0)) + ' dispatched\n'
+        if 'config_read' in metrics.timings:
+            output += 'Config Read: ' + self.__formatMs(metrics.timings['config_read'].max) + '\n'
+        if 'config_write' in metrics.timings:
+            write = metrics.timings['config_write']
+            output += 'Config Writes: ' + str(write.count) + ', mean ' + self.__formatMs(write.mean) + \
+                ', max ' + self.__formatMs(write.max) + '\n'
+        if 'config_record' in metrics.timings:
+            record = metrics.timings['config_record']
+            output += 'Config Changes Recorded: ' + str(record.count) + ', mean ' + \
+                self.__formatMs(record.mean) + ', max ' + self.__formatMs(record.max) + '\n'
+        if 'outbox_latency' in metrics.timings:
+            output += 'Replies: ' + str(int(metrics.gauges.get('outbox_depth', 0))) + ' pending, mean delivery ' + \
+                self.__formatMs(metrics.timings['outbox_latency'].mean) + '\n'
+
+        commandTimings = sorted(
+            ((labels_of(name)['command'], timing) for name, timing in metrics.timings.items()
+             if split_name(name)[0] == 'command_latency'),
+            key=lambda item: item[1].total, reverse=True)
+        output += '\nCommands (count, mean, p99, max):\n'
+        if len(commandTimings) == 0:
+            output += 'None\n'
+        for command, timing in commandTimings[:15]:
+            output += command + ': ' + str(timing.count) + ', ' + self.__formatMs(timing.mean) + \
+                ', <= ' + self.__formatMs(timing.quantile(0.99)) + ', ' + self.__formatMs(timing.max) + '\n'
+
+        guildTimes = sorted(
+            ((int(labels_of(name)['guild']), total) for name, total in metrics.counters.items()
+             if split_name(name)[0] == 'guild_command_seconds'),
+            key=lambda item: item[1], reverse=True)
+        if len(guildTimes) > 0:
+            output += '\nBusiest Servers (total command time):\n'
+            for guildId, total in guildTimes[:5]:
+                guild = self.bot.get_guild(guildId)
+                output += (guild.name if guild is not None else 'Unknown') + ' (' + str(guildId) + '): ' + \
+                    self.__formatMs(total) + ' over ' + \
+                    str(metrics.counters.get(labelled('guild_commands', guild=guildId), 0)) + ' commands\n'
+
+        await self.__send(ctx, output)
 
     @commands.command()
     @commands.guild_only()
@@ -417,5 +668,109 @@ class AdministrationCommands(commands.Cog):
     async def updateConfig(self,  ctx):
         """Persists Config Data to Disk (performed automatically on shutdown)"""
         self.configManager.updateServerData(ctx.guild)
-        self.configManager.writeConfig()
-        await ctx.send('Server Data Updated!')
+        await self.configManager.flush()
+        await self.__send(ctx, 'Server Data Updated!')
+
+    # Instrumentation
+    async def cog_before_invoke(self, ctx):
+        ctx.invokeStart = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx):
+        # Runs whether or not the command succeeded, but not when its
+        # arguments failed to convert.
+        elapsed = time.perf_counter() - ctx.invokeStart
+        command = ctx.command.qualified_name
+        metrics.observe(labelled('command_latency', command=command), elapsed)
+        if ctx.command_failed:
+            metrics.increment(labelled('command_errors', command=command))
+        if ctx.guild is not None:
+            metrics.increment(labelled('guild_commands', guild=ctx.guild.id))
+            metrics.increment(labelled('guild_command_seconds', guild=ctx.guild.id), elapsed)
+
+    # Utility Functions
+    async def __send(self, ctx, content: str):
+        await self.outbox.send(ctx.channel, content)
+
+    async def __loadMembers(self, guild: discord.Guild, member_ids: List[int]):
+        # With member_cache set to 'lazy' only some members are cached, so
+        # fetch any missing ones. Commanders who turn out to have left the
+        # guild are pruned.
+        missing = [member_id for member_id in member_ids if guild.get_member(member_id) is None]
+        if len(missing) == 0 or guild.chunked:
+            return
+        start = time.perf_counter()
+        # Discord accepts at most 100 IDs per request.
+        for iStart in range(0, len(missing), 100):
+            await guild.query_members(user_ids=missing[iStart:iStart + 100], cache=True)
+        metrics.observe('member_query', time.perf_counter() - start)
+        self.configManager.pruneCommanders(guild, missing)
+
+    async def __loadAllMembers(self, guild: discord.Guild):
+        if guild.chunked:
+            return
+        task = self._chunking.get(guild.id)
+        if task is None:
+            task = self._chunking[guild.id] = asyncio.ensure_future(self.__chunkGuild(guild))
+        await asyncio.shield(task)
+
+    async def __chunkGuild(self, guild: discord.Guild):
+        try:
+            start = time.perf_counter()
+            await guild.chunk()
+            metrics.increment('guild_chunks')
+            metrics.observe('guild_chunk', time.perf_counter() - start)
+            self.configManager.pruneCommanders(guild)
+        finally:
+            self._chunking.pop(guild.id, None)
+
+    def __formatMemberId(self, guild: discord.Guild, memberId: int) -> str:
+        member = guild.get_member(memberId)
+        if member is None:
+            return str(memberId)
+        return member.name + '#' + member.discriminator + ' (' + str(memberId) + ')'
+
+    def __formatMs(self, seconds: float) -> str:
+        if seconds != seconds or seconds == float('inf'):
+            return 'n/a'
+        return '{:.1f} ms'.format(seconds * 1000)
+
+    def __canManageRole(self, ctx, role: discord.Role) -> bool:
+        return (
+            self.configManager.isCommander(ctx.guild, role, ctx.author) or
+            (
+                ctx.author.guild_permissions.manage_roles and
+                ctx.author.top_role.position >= role.position
+            )
+        )
+
+    async def __bulkUpdateRole(self, ctx, role: discord.Role, members: List[discord.Member], add: bool):
+        start = time.perf_counter()
+        reason = ('Added by ' if add else 'Removed by ') + ctx.author.name
+        # Members who already have (or don't have) the role need no API call.
+        pending = [member for member in dict.fromkeys(members) if (role in member.roles) != add]
+        skipped = len(set(members)) - len(pending)
+        failed = 0
+
+        # discord.py already queues requests per rate-limit bucket, and every
+        # member role edit in a guild shares one; the semaphore just bounds
+        # how many requests are waiting on it at once.
+        semaphore = asyncio.Semaphore(self.bulkConcurrency)
+
+        async def update(member: discord.Member):
+            nonlocal failed
+            async with semaphore:
+                try:
+                    if add:
+                        await member.add_roles(role, reason=reason)
+                    else:
+                        await member.remove_roles(role, reason=reason)
+                except discord.HTTPException:
+                    failed += 1
+
+        await asyncio.gather(*[update(member) for member in pending])
+
+        output = ('Added @' if add else 'Removed @') + role.name + (' to ' if add else ' from ')
+        output += str(len(pending) - failed) + ' members'
+        output += ' (' + str(skipped) + ' unchanged, ' + str(failed) + ' failed)'
+        output += ' in ' + '{:.1f}s'.format(time.perf_counter() - start)
+        await self.__send(ctx, output)
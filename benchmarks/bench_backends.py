@@ -0,0 +1,145 @@
+"""Measures BaseConfigManager operations on each storage backend against a
+synthetic fleet, without a Discord connection.
+
+Run from the repository root: python -m benchmarks.bench_backends
+For each backend and operation it reports throughput, p50/p99 latency and
+the peak memory allocated per call.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List
+
+from config.db_config import DbConfigManager
+from config.file_config import FileConfigManager
+from config.guild_file_config import GuildFileConfigManager
+
+from .fakes import FakeGuild, make_fleet
+
+BACKENDS = {
+    'file': lambda: FileConfigManager(),
+    'file+journal': lambda: FileConfigManager(journal=True),
+    'guild_files': lambda: GuildFileConfigManager(),
+    'sqlite': lambda: DbConfigManager(),
+}
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def measure(op: Callable[[int], None], count: int) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for i in range(count):
+        op_start = time.perf_counter()
+        op(i)
+        samples.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - start
+    samples.sort()
+
+    # A separate, shorter pass for allocations, as tracing slows every call.
+    alloc_count = min(count, 200)
+    peak = 0
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.start()
+        for i in range(alloc_count):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            op(i)
+            _, op_peak = tracemalloc.get_traced_memory()
+            peak += op_peak - before
+        tracemalloc.stop()
+
+    return {
+        'ops_per_sec': count / elapsed,
+        'p50_us': percentile(samples, 0.50) * 1e6,
+        'p99_us': percentile(samples, 0.99) * 1e6,
+        'alloc_kib': peak / alloc_count / 1024 if peak > 0 else None,
+    }
+
+
+def print_result(name: str, result: dict):
+    alloc = '{:10.1f}'.format(result['alloc_kib']) if result['alloc_kib'] is not None else '{:>10}'.format('-')
+    print('  {:20} {:12.0f} {:10.1f} {:10.1f} {}'.format(
+        name, result['ops_per_sec'], result['p50_us'], result['p99_us'], alloc))
+
+
+async def run_backend(name: str, make_manager, guilds: List[FakeGuild], ops: int):
+    manager = make_manager()
+    for guild in guilds:
+        manager.updateServerData(guild)
+        members = guild.members
+        for iRole, role in enumerate(guild.roles[1:11]):
+            manager.addCommander(guild, role, members[iRole % len(members)])
+            manager.setJoinableRole(guild, role, iRole % 2 == 0)
+    await manager.flush()
+
+    def pick(i: int):
+        guild = guilds[i % len(guilds)]
+        members = guild.members
+        return guild, guild.roles[1 + i % 10], members[i % len(members)]
+
+    def update_server_data(i):
+        manager.updateServerData(guilds[i % len(guilds)])
+
+    def get_joinable_roles(i):
+        manager.getJoinableRoles(guilds[i % len(guilds)])
+
+    def is_commander(i):
+        guild, role, member = pick(i)
+        manager.isCommander(guild, role, member)
+
+    def is_joinable_role(i):
+        guild, role, _ = pick(i)
+        manager.isJoinableRole(guild, role)
+
+    def add_commander(i):
+        guild, role, member = pick(i)
+        manager.addCommander(guild, role, member)
+
+    def write_config(i):
+        manager.writeConfig({guilds[i % len(guilds)].id})
+
+    print(name)
+    print('  {:20} {:>12} {:>10} {:>10} {:>10}'.format('operation', 'ops/sec', 'p50 us', 'p99 us', 'KiB/op'))
+    print_result('isCommander', measure(is_commander, ops))
+    print_result('isJoinableRole', measure(is_joinable_role, ops))
+    print_result('getJoinableRoles', measure(get_joinable_roles, ops))
+    print_result('addCommander', measure(add_commander, ops))
+    print_result('updateServerData', measure(update_server_data, max(1, ops // 10)))
+    print_result('writeConfig', measure(write_config, max(1, ops // 100)))
+
+    await manager.close()
+
+
+async def run(args):
+    guilds = make_fleet(args.guilds, args.roles, args.members)
+    print('Fleet: {} guilds x {} roles x {} members'.format(args.guilds, args.roles, args.members))
+
+    for name in args.backends:
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            os.mkdir('data')
+            try:
+                await run_backend(name, BACKENDS[name], guilds, args.ops)
+            finally:
+                os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=200)
+    parser.add_argument('--roles', type=int, default=100)
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--ops', type=int, default=10000)
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Compares config encode time for the legacy reflective ObjectEncoder and
+the to_json serializers.
+
+Run from the repository root: python -m benchmarks.bench_encode
+"""
+import argparse
+import inspect
+import json
+import time
+
+from config import config_model
+
+from . import legacy_model
+
+
+class LegacyObjectEncoder(json.JSONEncoder):
+    # Copy of the encoder config/file_config.py used before to_json existed,
+    # minus the to_json shortcut. It only handles the legacy __dict__ model.
+    def default(self, obj):
+        if hasattr(obj, "__dict__"):
+            d = dict(
+                (key, value)
+                for key, value in inspect.getmembers(obj)
+                if not key.startswith("_")
+                and not inspect.isabstract(value)
+                and not inspect.isbuiltin(value)
+                and not inspect.isfunction(value)
+                and not inspect.isgenerator(value)
+                and not inspect.isgeneratorfunction(value)
+                and not inspect.ismethod(value)
+                and not inspect.ismethoddescriptor(value)
+                and not inspect.isroutine(value)
+            )
+            return self.default(d)
+        return obj
+
+
+def make_config(model, guilds: int, roles: int) -> dict:
+    config = {}
+    for guild_id in range(1, guilds + 1):
+        role_data = {}
+        for role_id in range(1, roles + 1):
+            role_data[role_id] = model.ServerRoleData(
+                role_id, 'Role ' + str(role_id), role_id % 5 == 0, [role_id, role_id + 1])
+        gate_data = model.ServerGateData(True, False, 1, {i: i for i in range(10)})
+        config[guild_id] = model.ServerData(
+            guild_id, 'Server ' + str(guild_id), 'Hi @@NAME@@', gate_data, role_data)
+    return config
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--roles', type=int, default=250)
+    args = parser.parse_args()
+
+    print('Config: ' + str(args.guilds) + ' guilds x ' + str(args.roles) + ' roles')
+
+    legacy_config = make_config(legacy_model, args.guilds, args.roles)
+    legacy = timed(lambda: json.dumps(legacy_config, cls=LegacyObjectEncoder, indent=2))
+    del legacy_config
+
+    config = make_config(config_model, args.guilds, args.roles)
+    print('ObjectEncoder (indented):   {:8.3f}s'.format(legacy))
+
+    def to_json(indent, separators=None):
+        snapshot = {server_id: server.to_json() for server_id, server in config.items()}
+        json.dumps(snapshot, indent=indent, separators=separators)
+
+    indented = timed(lambda: to_json(2))
+    print('to_json (indented):         {:8.3f}s  ({:.1f}x)'.format(indented, legacy / indented))
+    compact = timed(lambda: to_json(None, (',', ':')))
+    print('to_json (compact):          {:8.3f}s  ({:.1f}x)'.format(compact, legacy / compact))
+
+
+if __name__ == '__main__':
+    main()
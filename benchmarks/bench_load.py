@@ -0,0 +1,94 @@
+"""Measures startup time and peak RSS of loading a large data/config.json,
+comparing the old eager loader with FileConfigManager's incremental one.
+
+Run from the repository root: python -m benchmarks.bench_load
+Each loader runs in a fresh subprocess so peak RSS is measured separately.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ['eager', 'lazy', 'lazy-touch-all']
+
+
+def write_config(file_path: str, guilds: int, roles: int):
+    config = {}
+    for guild_id in range(1, guilds + 1):
+        role_data = {}
+        for role_id in range(1, roles + 1):
+            role_data[str(role_id)] = {
+                'id': role_id,
+                'name': 'Role ' + str(role_id),
+                'can_join': role_id % 5 == 0,
+                'commanders': [role_id, role_id + 1]
+            }
+        config[str(guild_id)] = {
+            'id': guild_id,
+            'name': 'Server ' + str(guild_id),
+            'greeting_message': 'Hi @@NAME@@',
+            'gate_data': {'gate_enabled': True, 'allow_rejoin': False, 'key_role_id': 1, 'keyed_users': {}},
+            'role_data': role_data
+        }
+    with open(file_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_mode(mode: str, file_path: str):
+    from config.file_config import FileConfigManager, ServerDataFile
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'eager':
+        # The loader FileConfigManager.readConfig used before.
+        with open(file_path, 'r') as f:
+            servers = ServerDataFile.from_json_list(json.load(f))
+        config_data = {server_id: servers[server_id] for server_id in servers.keys()}
+    else:
+        manager_cls = type('BenchConfigManager', (FileConfigManager,), {'config_path': file_path})
+        config_data = manager_cls().config_data
+        if mode == 'lazy-touch-all':
+            for server_id in list(config_data):
+                config_data[server_id]
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({'guilds': len(config_data), 'seconds': elapsed, 'rss_mb': peak_rss_mb() - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--roles', type=int, default=100)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.file)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'config.json')
+        write_config(file_path, args.guilds, args.roles)
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        print('Config: {} guilds x {} roles, {:.1f} MB'.format(args.guilds, args.roles, size_mb))
+
+        for mode in MODES:
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.bench_load', '--mode', mode, '--file', file_path])
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print('{:16} {:8.3f}s  +{:7.1f} MB peak RSS'.format(mode, result['seconds'], result['rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Measures the RSS of discord.py's member cache for one large guild under
+each member-cache policy the bot supports.
+
+Run from the repository root: python -m benchmarks.bench_member_cache
+Each policy runs in a fresh subprocess so peak RSS is measured separately.
+The guild is built from gateway-shaped payloads by discord.py itself, so
+the numbers include its Member, User and presence objects. Every policy
+then replays the same traffic through discord.py's gateway parsers:
+messages from random members, joins, and commands that fetch a member the
+way the bot's query_members(cache=True) calls do. Under 'lazy' the guild
+starts with only the bot cached, as Discord sends large guilds when chunking
+is off, so the cached count is whatever that traffic leaves behind.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from .bench_load import peak_rss_mb
+
+# presence_intent and member_cache settings, and what each leaves cached.
+MODES = {
+    'presences+all': 'presence_intent true, member_cache all',
+    'all': 'presence_intent false, member_cache all',
+    'lazy': 'presence_intent false, member_cache lazy',
+}
+
+
+def member_payload(member_id: int) -> dict:
+    return {
+        'user': {'id': str(member_id), 'username': 'Member ' + str(member_id),
+                 'discriminator': str(member_id % 10000).zfill(4), 'avatar': None},
+        'roles': [str(member_id % 50 + 1)],
+        'joined_at': '2020-01-01T00:00:00+00:00',
+        'deaf': False,
+        'mute': False,
+    }
+
+
+def presence_payload(member_id: int) -> dict:
+    return {
+        'user': {'id': str(member_id)},
+        'status': 'online',
+        'client_status': {'desktop': 'online'},
+        'activities': [{'type': 0, 'name': 'Game ' + str(member_id % 100)}],
+    }
+
+
+BOT_ID = 99
+CHANNEL_ID = 10
+
+
+def guild_payload(members: int, cached: int, presences: bool) -> dict:
+    return {
+        'id': '1',
+        'name': 'Server 1',
+        'member_count': members + 1,
+        'roles': [{'id': str(role_id), 'name': 'Role ' + str(role_id), 'permissions': '0',
+                   'position': role_id, 'color': 0, 'hoist': False, 'managed': False,
+                   'mentionable': False} for role_id in range(1, 51)],
+        'channels': [{'id': str(CHANNEL_ID), 'type': 0, 'name': 'general', 'position': 0,
+                      'permission_overwrites': []}],
+        'members': [member_payload(BOT_ID)] + [member_payload(member_id) for member_id in range(100, 100 + cached)],
+        'presences': [presence_payload(member_id) for member_id in range(100, 100 + cached)] if presences else [],
+    }
+
+
+def message_payload(message_id: int, member_id: int) -> dict:
+    member = member_payload(member_id)
+    return {
+        'id': str(message_id), 'channel_id': str(CHANNEL_ID), 'guild_id': '1', 'author': member['user'],
+        'member': {key: value for key, value in member.items() if key != 'user'},
+        'content': 'hello', 'type': 0, 'timestamp': '2021-01-01T00:00:00+00:00',
+        'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+        'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False,
+    }
+
+
+def replay_traffic(state, guild, members: int, args) -> dict:
+    import discord
+
+    rng = random.Random(args.seed)
+    counts = {'messages': 0, 'joins': 0, 'lookups': 0}
+    next_member = 100 + members
+    for iEvent in range(args.events):
+        roll = rng.random()
+        if roll < args.join_rate:
+            data = member_payload(next_member)
+            data['guild_id'] = '1'
+            state.parse_guild_member_add(data)
+            next_member += 1
+            counts['joins'] += 1
+        elif roll < args.join_rate + args.lookup_rate:
+            # What a ChunkRequest made by query_members(cache=True) does with
+            # each member Discord returns.
+            member_id = rng.randrange(100, 100 + members)
+            guild._add_member(discord.Member(data=member_payload(member_id), guild=guild, state=state))
+            counts['lookups'] += 1
+        else:
+            state.parse_message_create(message_payload(10 ** 6 + iEvent, rng.randrange(100, 100 + members)))
+            counts['messages'] += 1
+    return counts
+
+
+def run_mode(mode: str, args):
+    import discord
+    from discord.state import ConnectionState
+
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.presences = mode == 'presences+all'
+    cached = 0 if mode == 'lazy' else args.members
+
+    loop = asyncio.new_event_loop()
+    state = ConnectionState(dispatch=lambda *args: None, handlers={}, hooks={}, syncer=None,
+                            http=None, loop=loop, intents=intents)
+
+    # Build the payload first so only the cache is counted.
+    data = guild_payload(args.members, cached, intents.presences)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    guild = state._add_guild_from_data(data)
+    elapsed = time.perf_counter() - start
+    del data
+    counts = replay_traffic(state, guild, args.members, args)
+    rss = peak_rss_mb() - baseline
+
+    print(json.dumps({'cached': len(guild.members), 'chunked': guild.chunked,
+                      'seconds': elapsed, 'rss_mb': rss, 'traffic': counts}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--events', type=int, default=20000, help='gateway events replayed after startup')
+    parser.add_argument('--join-rate', type=float, default=0.005, help='fraction of events that are joins')
+    parser.add_argument('--lookup-rate', type=float, default=0.02,
+                        help='fraction of events that are commands fetching a member')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mode', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args)
+        return
+
+    print('Guild: {} members; traffic: {} events, {:.1%} joins, {:.1%} member lookups'.format(
+        args.members, args.events, args.join_rate, args.lookup_rate))
+    for mode, description in MODES.items():
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.bench_member_cache', '--mode', mode,
+             '--members', str(args.members), '--events', str(args.events),
+             '--join-rate', str(args.join_rate), '--lookup-rate', str(args.lookup_rate),
+             '--seed', str(args.seed)])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        print('{:14} {:7} cached {:7.3f}s  +{:7.1f} MB peak RSS  ({})'.format(
+            mode, result['cached'], result['seconds'], result['rss_mb'], description))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compares memory use and permission-check cost of the legacy
+property-based config model with the __slots__ model.
+
+Run from the repository root: python -m benchmarks.bench_model_memory
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from config import config_model
+
+from . import legacy_model
+
+
+def make_config(model, guilds: int, roles: int) -> dict:
+    config = {}
+    for guild_id in range(1, guilds + 1):
+        role_data = {}
+        for role_id in range(1, roles + 1):
+            commanders = [role_id] if role_id % 10 == 0 else []
+            role_data[role_id] = model.ServerRoleData(
+                role_id, 'Role ' + str(role_id), role_id % 5 == 0, commanders)
+        config[guild_id] = model.ServerData(
+            guild_id, 'Server ' + str(guild_id), '', model.ServerGateData(False, False, 0, {}), role_data)
+    return config
+
+
+def measure(model, guilds: int, roles: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    config = make_config(model, guilds, roles)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del config
+    return size / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--roles', type=int, default=250)
+    parser.add_argument('--checks', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print('Config: {} guilds x {} roles'.format(args.guilds, args.roles))
+    legacy = measure(legacy_model, args.guilds, args.roles)
+    print('legacy model   {:8.1f} MB'.format(legacy))
+    slots = measure(config_model, args.guilds, args.roles)
+    print('slots model    {:8.1f} MB  ({:.0f}% less)'.format(slots, (1 - slots / legacy) * 100))
+
+    # Permission check: is member 10 a commander of role 10 in guild 1?
+    legacy_server = make_config(legacy_model, 1, args.roles)[1]
+    server = make_config(config_model, 1, args.roles)[1]
+
+    start = time.perf_counter()
+    for _ in range(args.checks):
+        10 in legacy_server.role_data[10].commanders
+    legacy_check = (time.perf_counter() - start) / args.checks
+    start = time.perf_counter()
+    for _ in range(args.checks):
+        server.is_commander(10, 10)
+    check = (time.perf_counter() - start) / args.checks
+    print('isCommander    legacy {:6.3f} us, slots {:6.3f} us'.format(legacy_check * 1e6, check * 1e6))
+
+
+if __name__ == '__main__':
+    main()
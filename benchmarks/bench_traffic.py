@@ -0,0 +1,255 @@
+"""Replays synthetic guild traffic through jarvis.py's on_message and the
+AdministrationCommands cog, with Discord's HTTP API stubbed out.
+
+Run from the repository root: python -m benchmarks.bench_traffic
+Messages are fed through discord.py's own gateway parsers, so message
+construction, event dispatch, command parsing and converters are all
+included. Reports messages/sec, handler latency for chat and commands, and
+event loop lag.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from .fakes import StubHTTP
+
+ADMINISTRATOR = 0x8
+BOT_ID = 1
+OWNER_ID = 2
+
+
+def user_payload(user_id: int) -> dict:
+    return {'id': str(user_id), 'username': 'Member ' + str(user_id),
+            'discriminator': str(user_id % 10000).zfill(4), 'avatar': None}
+
+
+def member_payload(user_id: int, role_ids: List[int]) -> dict:
+    return {'user': user_payload(user_id), 'roles': [str(role_id) for role_id in role_ids],
+            'joined_at': '2021-01-01T00:00:00+00:00', 'deaf': False, 'mute': False}
+
+
+def guild_payload(guild_id: int, roles: int, members: int) -> dict:
+    # Converters only match ids of snowflake length.
+    base = guild_id * 10 ** 17
+    role_payloads = [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0}]
+    role_payloads.append({'id': str(base + 1), 'name': 'Admin', 'permissions': str(ADMINISTRATOR),
+                          'position': roles + 1})
+    for iRole in range(2, roles + 2):
+        role_payloads.append({'id': str(base + iRole), 'name': 'Role ' + str(iRole),
+                              'permissions': '0', 'position': iRole - 1})
+    for role in role_payloads:
+        role.update({'color': 0, 'hoist': False, 'managed': False, 'mentionable': False})
+
+    member_payloads = [member_payload(BOT_ID, []), member_payload(OWNER_ID, [base + 1])]
+    for iMember in range(members):
+        member_payloads.append(member_payload(base + 500000 + iMember, [base + 2 + iMember % roles]))
+
+    return {
+        'id': str(guild_id), 'name': 'Server ' + str(guild_id), 'owner_id': str(OWNER_ID),
+        'member_count': len(member_payloads), 'roles': role_payloads, 'members': member_payloads,
+        'channels': [{'id': str(base + 999999), 'type': 0, 'name': 'general', 'position': 0,
+                      'permission_overwrites': []}],
+    }
+
+
+class Traffic:
+    """Generates gateway MESSAGE_CREATE and GUILD_MEMBER_ADD payloads."""
+
+    def __init__(self, guilds, commanders: Dict[int, int], mix: Dict[str, float], seed: int):
+        self.guilds = guilds
+        self.commanders = commanders
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.random = random.Random(seed)
+        self.next_id = 10 ** 15
+        self.next_member = 10 ** 14
+
+    def next(self) -> Tuple[str, dict, dict]:
+        guild = self.random.choice(self.guilds)
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        roles = [role for role in guild.roles if not role.is_default() and role.name != 'Admin']
+        role = self.random.choice(roles)
+        author = self.random.choice(guild.members)
+
+        if kind == 'chat':
+            content = 'just chatting about role ' + role.name
+        elif kind == 'joinRole':
+            content = '!joinRole ' + str(role.id)
+        elif kind == 'addRole':
+            author = guild.get_member(self.commanders[guild.id])
+            content = '!addRole ' + str(role.id) + ' ' + str(self.random.choice(guild.members).id)
+        else:
+            # A join: the member arrives, then Discord posts the join message.
+            self.next_member += 1
+            data = member_payload(self.next_member, [])
+            data['guild_id'] = str(guild.id)
+            return 'join', data, self.__message(guild, data, '', 7)
+
+        return kind, None, self.__message(guild, member_payload(author.id, [r.id for r in author.roles[1:]]),
+                                          content, 0)
+
+    def __message(self, guild, member: dict, content: str, message_type: int) -> dict:
+        self.next_id += 1
+        return {
+            'id': str(self.next_id), 'channel_id': str(guild.text_channels[0].id), 'guild_id': str(guild.id),
+            'author': member['user'], 'member': {key: value for key, value in member.items() if key != 'user'},
+            'content': content, 'type': message_type, 'timestamp': '2021-01-01T00:00:00+00:00',
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+            'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False,
+        }
+
+
+def summarize(samples: List[float]) -> str:
+    if len(samples) == 0:
+        return '-'
+    samples = sorted(samples)
+
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1e3
+
+    return 'p50 {:8.2f} ms  p99 {:8.2f} ms  max {:8.2f} ms  (n={})'.format(
+        at(0.50), at(0.99), samples[-1] * 1e3, len(samples))
+
+
+async def sample_loop_lag(interval: float, samples: List[float]):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run(jarvis, args):
+    from discord import ClientUser
+
+    from metrics import metrics
+
+    bot = jarvis.bot
+    state = bot._connection
+    http = StubHTTP(user_payload(BOT_ID), args.http_latency)
+    bot.http = state.http = http
+    state.user = ClientUser(state=state, data=dict(user_payload(BOT_ID), bot=True))
+    for guild_id in range(1, args.guilds + 1):
+        state._add_guild_from_data(guild_payload(guild_id, args.roles, args.members))
+
+    jarvis.settings.greeting_delay = args.greeting_delay
+    await jarvis.setup()
+    configManager = jarvis.configManager
+
+    # Every role is joinable, and one member per guild commands them all.
+    commanders = {}
+    for guild in bot.guilds:
+        configManager.setGreetingMessage(guild, 'Welcome @@NAME@@!')
+        commander = guild.members[2]
+        commanders[guild.id] = commander.id
+        for role in guild.roles:
+            if not role.is_default():
+                configManager.setJoinableRole(guild, role, True)
+                configManager.addCommander(guild, role, commander)
+
+    # Time each on_message call as discord.py dispatches it.
+    latencies: Dict[str, List[float]] = {'chat': [], 'command': []}
+    onMessage = jarvis.on_message
+
+    async def timed_on_message(message):
+        start = time.perf_counter()
+        await onMessage(message)
+        kind = 'command' if message.content.startswith(jarvis.COMMAND_PREFIX) else 'chat'
+        latencies[kind].append(time.perf_counter() - start)
+
+    bot.on_message = timed_on_message
+
+    lag: List[float] = []
+    lag_task = asyncio.ensure_future(sample_loop_lag(0.01, lag))
+    traffic = Traffic(bot.guilds, commanders, args.mix, args.seed)
+    counts: Dict[str, int] = {}
+
+    start = time.perf_counter()
+    for iMessage in range(args.messages):
+        kind, join, message = traffic.next()
+        counts[kind] = counts.get(kind, 0) + 1
+        if join is not None:
+            state.parse_guild_member_add(join)
+        state.parse_message_create(message)
+
+        if args.rate > 0:
+            # Pace to the target rate.
+            delay = start + (iMessage + 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif (iMessage + 1) % args.burst == 0:
+            await asyncio.sleep(0)
+
+    # Let every handler, greeting and queued reply finish.
+    while len(latencies['chat']) + len(latencies['command']) < args.messages:
+        await asyncio.sleep(0.01)
+    handled = time.perf_counter() - start
+    await asyncio.sleep(args.greeting_delay)
+    await jarvis.outbox.close()
+    lag_task.cancel()
+
+    print('Traffic: {} messages across {} guilds ({})'.format(
+        args.messages, args.guilds, ', '.join(kind + ' ' + str(count) for kind, count in sorted(counts.items()))))
+    print('Handled in {:.3f}s: {:.0f} messages/sec'.format(handled, args.messages / handled))
+    print('  chat      ' + summarize(latencies['chat']))
+    print('  commands  ' + summarize(latencies['command']))
+    print('  loop lag  ' + summarize(lag))
+    print('  dispatched {} of {} messages to process_commands'.format(
+        metrics.counters.get('messages_dispatched', 0), metrics.counters.get('messages_seen', 0)))
+    print('  HTTP calls: ' + ', '.join(name + ' ' + str(count) for name, count in sorted(http.calls.items())))
+    outbox_latency = metrics.timings.get('outbox_latency')
+    if outbox_latency is not None:
+        print('  replies: {} sent as {} messages, queue-to-send mean {:.2f} ms, max {:.2f} ms'.format(
+            metrics.counters.get('outbox_queued', 0), metrics.counters.get('outbox_sends', 0),
+            outbox_latency.mean * 1e3, outbox_latency.max * 1e3))
+
+    jarvis.rekeyer.close()
+    await configManager.close()
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--roles', type=int, default=50)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=0.90,joinRole=0.05,addRole=0.03,join=0.02'),
+                        help='weights for chat, joinRole, addRole and join traffic')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='messages per second; 0 feeds them as fast as possible')
+    parser.add_argument('--burst', type=int, default=100,
+                        help='messages fed between yields to the loop when --rate is 0')
+    parser.add_argument('--http-latency', type=float, default=0.05, help='seconds per stubbed HTTP call')
+    parser.add_argument('--greeting-delay', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # jarvis.py reads data/settings.json and writes config data relative to
+    # the working directory, so run it in a scratch one.
+    root = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.mkdir('data')
+        sys.path.insert(0, root)
+        try:
+            import jarvis
+            # discord.py 1.x binds the bot to the loop current at import.
+            jarvis.bot.loop.run_until_complete(run(jarvis, args))
+        finally:
+            os.chdir(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Stand-ins for discord.Guild, discord.Role and discord.Member with just the
+attributes the config managers use, a generator for synthetic fleets, and a
+stub for discord.py's HTTP client.
+"""
+import asyncio
+from typing import Dict, List
+
+
+class FakeRole:
+    def __init__(self, id: int, name: str, guild: 'FakeGuild', position: int = 0):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.position = position
+
+    def is_default(self) -> bool:
+        return self.id == self.guild.id
+
+    @property
+    def mention(self) -> str:
+        return '<@&' + str(self.id) + '>'
+
+
+class FakeMember:
+    def __init__(self, id: int, guild: 'FakeGuild', name: str = None, discriminator: str = '0001'):
+        self.id = id
+        self.guild = guild
+        self.name = name if name is not None else 'Member ' + str(id)
+        self.display_name = self.name
+        self.discriminator = discriminator
+        self.bot = False
+        self.roles: List[FakeRole] = []
+
+    @property
+    def mention(self) -> str:
+        return '<@' + str(self.id) + '>'
+
+
+class FakeGuild:
+    def __init__(self, id: int, name: str = None):
+        self.id = id
+        self.name = name if name is not None else 'Server ' + str(id)
+        # Like Discord, the @everyone role shares the guild's id.
+        self.roles: List[FakeRole] = [FakeRole(id, '@everyone', self)]
+        self._roles: Dict[int, FakeRole] = {id: self.roles[0]}
+        self._members: Dict[int, FakeMember] = {}
+        self.chunked = True
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    def add_role(self, id: int, name: str = None) -> FakeRole:
+        role = FakeRole(id, name if name is not None else 'Role ' + str(id), self, len(self.roles))
+        self.roles.append(role)
+        self._roles[id] = role
+        return role
+
+    def add_member(self, id: int) -> FakeMember:
+        member = self._members[id] = FakeMember(id, self)
+        return member
+
+    def get_member(self, id: int) -> FakeMember:
+        return self._members.get(id)
+
+    def get_role(self, id: int) -> FakeRole:
+        return self._roles.get(id)
+
+
+def make_fleet(guilds: int, roles: int, members: int) -> List[FakeGuild]:
+    """Builds guilds with ids 1..guilds, each with its own roles and members.
+    Ids are unique across the fleet, as snowflakes are."""
+    fleet = []
+    for guild_id in range(1, guilds + 1):
+        guild = FakeGuild(guild_id)
+        base = guild_id * 1000000
+        for iRole in range(roles):
+            guild.add_role(base + iRole + 1)
+        for iMember in range(members):
+            guild.add_member(base + 500000 + iMember)
+        fleet.append(guild)
+    return fleet
+
+
+class StubHTTP:
+    """Stands in for discord.py's HTTPClient, answering the calls the bot
+    makes with minimal payloads after a fixed delay."""
+
+    def __init__(self, user: dict, latency: float = 0.0):
+        self.user = user
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._next_id = 1
+
+    async def send_message(self, channel_id: int, content: str, **kwargs) -> dict:
+        await self.__call('send_message')
+        return self.__message(channel_id, content)
+
+    async def send_files(self, channel_id: int, *, files, content: str = None, **kwargs) -> dict:
+        await self.__call('send_files')
+        return self.__message(channel_id, content)
+
+    async def add_role(self, guild_id: int, user_id: int, role_id: int, *, reason: str = None):
+        await self.__call('add_role')
+
+    async def remove_role(self, guild_id: int, user_id: int, role_id: int, *, reason: str = None):
+        await self.__call('remove_role')
+
+    async def close(self):
+        pass
+
+    async def __call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    def __message(self, channel_id: int, content: str) -> dict:
+        self._next_id += 1
+        return {
+            'id': str(self._next_id), 'channel_id': str(channel_id), 'author': self.user,
+            'content': content or '', 'type': 0, 'timestamp': '2021-01-01T00:00:00+00:00',
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+            'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False,
+        }
@@ -1,2 +1,78 @@
+import json
+
+
 class BaseConfig:
-    pass
\ No newline at end of file
+    """Bot-wide settings, loaded from data/settings.json when present."""
+
+    def __init__(self, save_interval: float = 10.0, compact_config: bool = False,
+                 config_backend: str = 'file', config_journal: bool = False,
+                 journal_compact_records: int = 1000, bulk_role_concurrency: int = 5,
+                 send_queue_size: int = 50, greeting_delay: float = 3.0,
+                 presence_intent: bool = False, member_cache: str = 'all',
+                 rekey_concurrency: int = 2, metrics_file: str = '', metrics_port: int = 0,
+                 metrics_interval: float = 15.0, log_level: str = 'INFO', log_file: str = '',
+                 auto_shard: bool = False, shard_count: int = 0, shard_ids: str = '',
+                 worker_processes: int = 1, change_poll_interval: float = 2.0):
+        self.save_interval = save_interval
+        self.compact_config = compact_config
+        self.config_backend = config_backend
+        self.config_journal = config_journal
+        self.journal_compact_records = journal_compact_records
+        self.bulk_role_concurrency = bulk_role_concurrency
+        self.send_queue_size = send_queue_size
+        self.greeting_delay = greeting_delay
+        self.presence_intent = presence_intent
+        self.member_cache = member_cache
+        self.rekey_concurrency = rekey_concurrency
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        self.log_level = log_level
+        self.log_file = log_file
+        self.auto_shard = auto_shard
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.worker_processes = worker_processes
+        self.change_poll_interval = change_poll_interval
+
+    @classmethod
+    def from_json(cls, data: dict):
+        defaults = cls()
+        save_interval = data.get("save_interval", defaults.save_interval)
+        compact_config = data.get("compact_config", defaults.compact_config)
+        config_backend = data.get("config_backend", defaults.config_backend)
+        config_journal = data.get("config_journal", defaults.config_journal)
+        journal_compact_records = data.get(
+            "journal_compact_records", defaults.journal_compact_records)
+        bulk_role_concurrency = data.get(
+            "bulk_role_concurrency", defaults.bulk_role_concurrency)
+        send_queue_size = data.get("send_queue_size", defaults.send_queue_size)
+        greeting_delay = data.get("greeting_delay", defaults.greeting_delay)
+        presence_intent = data.get("presence_intent", defaults.presence_intent)
+        member_cache = data.get("member_cache", defaults.member_cache)
+        rekey_concurrency = data.get("rekey_concurrency", defaults.rekey_concurrency)
+        metrics_file = data.get("metrics_file", defaults.metrics_file)
+        metrics_port = data.get("metrics_port", defaults.metrics_port)
+        metrics_interval = data.get("metrics_interval", defaults.metrics_interval)
+        log_level = data.get("log_level", defaults.log_level)
+        log_file = data.get("log_file", defaults.log_file)
+        auto_shard = data.get("auto_shard", defaults.auto_shard)
+        shard_count = data.get("shard_count", defaults.shard_count)
+        shard_ids = data.get("shard_ids", defaults.shard_ids)
+        worker_processes = data.get("worker_processes", defaults.worker_processes)
+        change_poll_interval = data.get("change_poll_interval", defaults.change_poll_interval)
+
+        return cls(float(save_interval), bool(compact_config), str(config_backend),
+                   bool(config_journal), int(journal_compact_records), int(bulk_role_concurrency),
+                   int(send_queue_size), float(greeting_delay), bool(presence_intent),
+                   str(member_cache), int(rekey_concurrency), str(metrics_file), int(metrics_port),
+                   float(metrics_interval), str(log_level), str(log_file), bool(auto_shard),
+                   int(shard_count), str(shard_ids), int(worker_processes), float(change_poll_interval))
+
+    @classmethod
+    def load(cls, file_path: str = 'data/settings.json'):
+        try:
+            with open(file_path, 'r') as f:
+                return cls.from_json(json.load(f))
+        except FileNotFoundError:
+            return cls()
@@ -1,17 +1,37 @@
-from typing import Dict, List
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
 from abc import ABCMeta, abstractmethod
 
 import discord
 
+from metrics import metrics
+
 from .config_model import ServerData, ServerRoleData, ServerGateData, ConfigData
 
+log = logging.getLogger(__name__)
+
 
 class BaseConfigManager(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self):
+    def __init__(self, save_interval: float = 10.0):
         self.config_data: ConfigData = dict()
+        self.save_interval = save_interval
+        self._dirty_guilds: Set[int] = set()
+        self._save_task: asyncio.Task = None
+        # Flushes from the write-behind loop, commands and close() run one at
+        # a time, so a backend's write steps never interleave.
+        self._flush_lock = asyncio.Lock()
+        # Hash of each guild's roles as of the last full reconcile.
+        self._role_fingerprints: Dict[int, int] = {}
+        # A single worker keeps writes in submission order.
+        self._io_executor = ThreadPoolExecutor(max_workers=1)
+        start = time.perf_counter()
         self.readConfig()
+        metrics.observe('config_read', time.perf_counter() - start)
 
     @abstractmethod
     def readConfig(self):
@@ -19,79 +39,178 @@ class BaseConfigManager(object):
             "readConfig not implemented on base ConfigManager")
 
     @abstractmethod
-    def writeConfig(self):
+    def writeConfig(self, guild_ids: Set[int] = None):
+        """Writes the given guilds to storage, or everything if guild_ids is None."""
         raise NotImplementedError(
             "writeConfig not implemented on base ConfigManager")
 
-    def updateServerData(self, guild: discord.Guild):
-        server_data = self.config_data[guild.id] if self.config_data.get(
-            guild.id) is not None else ServerData.from_discord_guild(guild)
-        server_data.name = guild.name
-        self.config_data[guild.id] = server_data
-        # __update_roles_data_from_discord updates the DB, so we don't need to.
-        self.__update_roles_data_from_discord(guild)
+    async def write_config_async(self, guild_ids: Set[int] = None):
+        """Writes the config without blocking the event loop."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._io_executor, self.writeConfig, guild_ids)
+
+    # Write-behind persistence
+    def markDirty(self, guild_id: int):
+        self._dirty_guilds.add(guild_id)
+
+    def _recordChange(self, guild_id: int, change: str, **fields):
+        # Called after every mutation. Backends that persist changes one at a
+        # time override this; the default batches the guild for the next flush.
+        self.markDirty(guild_id)
+
+    def isDirty(self) -> bool:
+        return len(self._dirty_guilds) > 0
+
+    async def flush(self):
+        """Writes any pending changes to storage immediately."""
+        async with self._flush_lock:
+            await self._writeDirty()
+
+    async def _writeDirty(self):
+        if not self.isDirty():
+            return
+        dirty = self._dirty_guilds
+        self._dirty_guilds = set()
+        start = time.perf_counter()
+        try:
+            await self.write_config_async(dirty)
+        except Exception:
+            self._dirty_guilds |= dirty
+            metrics.increment('config_write_failures')
+            raise
+        metrics.observe('config_write', time.perf_counter() - start)
+        metrics.increment('config_write_guilds', len(dirty))
+
+    def startWriteBehind(self):
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.ensure_future(self.__writeBehindLoop())
+
+    async def close(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        await self.flush()
+
+    async def __writeBehindLoop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.flush()
+            except Exception as ex:
+                log.error('Unable to write Config Data: %s', ex)
 
-    def __update_roles_data_from_discord(self, guild: discord.Guild):
-        new_roles_data: Dict[int, ServerRoleData] = {}
+    def updateServerData(self, guild: discord.Guild):
+        server_data = self.__update_roles_data_from_discord(guild)
+
+        # Queue a write to the DB
+        self._recordChange(server_data.id, 'server')
+
+    async def updateAllServerData(self, guilds: List[discord.Guild], chunk_size: int = 50) -> Dict[str, float]:
+        """Reconciles every guild with Discord and persists the result once.
+        Returns the time taken by each phase, in seconds."""
+        timings: Dict[str, float] = {}
+
+        # Reconciling reads discord.py's caches, which belong to the loop, so
+        # it runs there in chunks and yields between them to keep the
+        # gateway heartbeat going.
+        start = time.perf_counter()
+        for iGuild, guild in enumerate(guilds):
+            self.__update_roles_data_from_discord(guild)
+            self.markDirty(guild.id)
+            if (iGuild + 1) % chunk_size == 0:
+                await asyncio.sleep(0)
+        timings['reconcile'] = time.perf_counter() - start
+
+        # Marking the guilds dirty and flushing lets each backend write them
+        # in one batch.
+        start = time.perf_counter()
+        await self.flush()
+        timings['persist'] = time.perf_counter() - start
+
+        return timings
+
+    async def reconcileServerData(self, guilds: List[discord.Guild], chunk_size: int = 50) -> Dict[str, float]:
+        """Catches up on changes missed while disconnected. Only guilds whose
+        roles changed are fully reconciled; the rest just have departed
+        commanders removed."""
+        start = time.perf_counter()
+        changed = 0
+
+        for iGuild, guild in enumerate(guilds):
+            server_data = self.config_data.get(guild.id)
+            if server_data is None or self._role_fingerprints.get(guild.id) != self.__roleFingerprint(guild):
+                self.updateServerData(guild)
+                changed += 1
+            else:
+                if server_data.name != guild.name:
+                    server_data.name = guild.name
+                    self._recordChange(guild.id, 'server')
+                self.pruneCommanders(guild)
 
-        server_data = self.config_data[guild.id] if self.config_data.get(
-            guild.id) is not None else ServerData.from_discord_guild(guild)
+            if (iGuild + 1) % chunk_size == 0:
+                await asyncio.sleep(0)
 
-        for iRole in range(len(guild.roles)):
-            role = guild.roles[iRole]
-            if not role.is_default():
-                # Get the Role Data from memory
-                old_role_data = server_data.role_data[role.id] if server_data.role_data.get(
-                    role.id) is not None else ServerRoleData.from_discord_role(role)
+        await self.flush()
+        return {'guilds': len(guilds), 'changed': changed, 'seconds': time.perf_counter() - start}
 
-                # Create new Role data with updated ID and Name from Discord
-                new_role_data = ServerRoleData(
-                    role.id, role.name, old_role_data.can_join, old_role_data.commanders)
+    def __update_roles_data_from_discord(self, guild: discord.Guild) -> ServerData:
+        server_data = self.config_data.get(guild.id)
+        if server_data is None:
+            server_data = ServerData.from_discord_guild(guild)
+        server_data.name = guild.name
 
-                # Strip out any commanders that are no longer part of the server.
-                new_commanders: List[int] = []
+        old_roles_data = server_data.role_data
+        new_roles_data: Dict[int, ServerRoleData] = {}
 
-                for commander in new_role_data.commanders:
-                    if guild.get_member(commander) is not None:
-                        new_commanders.append(commander)
+        for role in guild.roles:
+            if role.is_default():
+                continue
 
-                new_role_data.commanders = new_commanders
+            role_data = old_roles_data.get(role.id)
+            if role_data is None:
+                role_data = ServerRoleData.from_discord_role(role)
+            else:
+                role_data.name = role.name
+                # Strip out any commanders that are no longer part of the server.
+                # A guild whose members aren't all cached can't tell who left.
+                if len(role_data.commanders) > 0 and guild.chunked:
+                    role_data.commanders = [
+                        commander for commander in role_data.commanders
+                        if guild.get_member(commander) is not None]
 
-                new_roles_data[role.id] = new_role_data
+            new_roles_data[role.id] = role_data
 
-        # Replace server data in memory
+        # Replace server data in memory; this rebuilds its indexes.
         server_data.role_data = new_roles_data
         self.config_data[server_data.id] = server_data
+        self._role_fingerprints[guild.id] = self.__roleFingerprint(guild)
 
-        # Write to DB
-        self.writeConfig()
+        return server_data
 
     # Commanders
     def addCommander(self, guild: discord.Guild, role: discord.Role, member: discord.Member):
         _server = self.config_data[guild.id] if self.config_data.get(
             guild.id) is not None else ServerData.from_discord_guild(guild)
 
-        _role = _server.role_data[role.id] if _server.role_data.get(
-            role.id) is not None else ServerRoleData.from_discord_role(role)
-        _server.role_data[role.id] = _role
+        if _server.role_data.get(role.id) is None:
+            _server.set_role(ServerRoleData.from_discord_role(role))
+        self.config_data[guild.id] = _server
 
-        if member.id not in _role.commanders:
-            _role.commanders.append(member.id)
+        _server.add_commander(role.id, member.id)
 
-        self.writeConfig()
+        self._recordChange(guild.id, 'addCommander', role_id=role.id, member_id=member.id)
 
     def remCommander(self, guild: discord.Guild, role: discord.Role, member: discord.Member):
         _server = self.config_data[guild.id] if self.config_data.get(
             guild.id) is not None else ServerData.from_discord_guild(guild)
 
-        _role = _server.role_data[role.id] if _server.role_data.get(
-            role.id) is not None else ServerRoleData.from_discord_role(role)
-        _server.role_data[role.id] = _role
+        if _server.role_data.get(role.id) is None:
+            _server.set_role(ServerRoleData.from_discord_role(role))
+        self.config_data[guild.id] = _server
 
-        while member.id in _role.commanders:
-            _role.commanders.remove(member.id)
+        _server.remove_commander(role.id, member.id)
 
-        self.writeConfig()
+        self._recordChange(guild.id, 'remCommander', role_id=role.id, member_id=member.id)
 
     def listCommanders(self, guild: discord.Guild, role: discord.Role) -> str:
         _server = self.config_data[guild.id] if self.config_data.get(
@@ -113,46 +232,116 @@ class BaseConfigManager(object):
 
         return output
 
-    def isCommander(self, guild: discord.Guild, role: discord.Role, member: discord.Member) -> bool:
-        _server = self.config_data[guild.id] if self.config_data.get(
-            guild.id) is not None else ServerData.from_discord_guild(guild)
+    def getCommanders(self, guild: discord.Guild, role: discord.Role) -> List[int]:
+        _server = self.config_data.get(guild.id)
+        if _server is None or _server.role_data.get(role.id) is None:
+            return []
+        return list(_server.role_data[role.id].commanders)
+
+    def pruneCommanders(self, guild: discord.Guild, member_ids: List[int] = None):
+        """Removes commanders who have left the guild. Only member_ids are
+        checked if given; otherwise every commander is, provided all of the
+        guild's members are cached."""
+        server_data = self.config_data.get(guild.id)
+        if server_data is None:
+            return
+        if member_ids is None:
+            if not guild.chunked:
+                return
+            # Only members who command a role need checking.
+            member_ids = list(server_data.commander_ids())
+
+        for member_id in member_ids:
+            if guild.get_member(member_id) is None:
+                for role_id in list(server_data.roles_commanded_by(member_id)):
+                    server_data.remove_commander(role_id, member_id)
+                    self._recordChange(guild.id, 'remCommander',
+                                       role_id=role_id, member_id=member_id)
 
-        _role = _server.role_data[role.id] if _server.role_data.get(
-            role.id) is not None else ServerRoleData.from_discord_role(role)
+    def isCommander(self, guild: discord.Guild, role: discord.Role, member: discord.Member) -> bool:
+        _server = self.config_data.get(guild.id)
+        return _server is not None and _server.is_commander(role.id, member.id)
 
-        return member.id in _role.commanders
+    def getCommandedRoles(self, guild: discord.Guild, member: discord.Member) -> List[int]:
+        _server = self.config_data.get(guild.id)
+        if _server is None:
+            return []
+        return list(_server.roles_commanded_by(member.id))
 
     # Greetings
     def setGreetingMessage(self, guild: discord.Guild, greeting_message: str):
         self.config_data[guild.id].greeting_message = greeting_message
+        self._recordChange(guild.id, 'greeting')
 
     def getGreetingMessage(self, guild: discord.Guild) -> str:
-        old_message = self.config_data[guild.id].greeting_message
-        if old_message == '':
+        """Returns the guild's greeting, or None if it is unset or 'none'."""
+        server_data = self.config_data.get(guild.id)
+        if server_data is None:
             return None
-        else:
-            return old_message
+        message = server_data.greeting_message
+        if message is None or message == '' or message.lower() == 'none':
+            return None
+        return message
 
     # Joinable Roles
     def setJoinableRole(self, guild: discord.Guild, role: discord.Role, joinable: bool):
-        self.__update_roles_data_from_discord(guild)
+        server_data = self.config_data[guild.id]
+        if server_data.role_data.get(role.id) is None:
+            server_data.set_role(ServerRoleData.from_discord_role(role))
 
-        self.config_data[guild.id].role_data[role.id].can_join = joinable
+        server_data.set_role_joinable(role.id, joinable)
 
-        self.writeConfig()
+        self._recordChange(guild.id, 'joinable', role_id=role.id, can_join=joinable)
 
     def getJoinableRoles(self, guild: discord.Guild) -> List[int]:
-        self.__update_roles_data_from_discord(guild)
-        roles: List[int] = []
+        return list(self.config_data[guild.id].joinable_roles)
 
-        for role_id in self.config_data[guild.id].role_data.keys():
-            if self.config_data[guild.id].role_data[role_id].can_join:
-                roles.append(role_id)
+    def isJoinableRole(self, guild: discord.Guild, role: discord.Role) -> bool:
+        return role.id in self.config_data[guild.id].joinable_roles
+
+    # Discord events
+    # These keep role data in step with Discord as changes happen, instead of
+    # resyncing every role whenever joinable roles are read.
+    def roleCreated(self, role: discord.Role):
+        self.roleUpdated(role)
+
+    def roleUpdated(self, role: discord.Role):
+        server_data = self.config_data.get(role.guild.id)
+        if server_data is None or role.is_default():
+            return
+
+        self._role_fingerprints[server_data.id] = self.__roleFingerprint(role.guild)
+
+        role_data = server_data.role_data.get(role.id)
+        if role_data is None:
+            server_data.set_role(ServerRoleData.from_discord_role(role))
+        elif role_data.name != role.name:
+            role_data.name = role.name
+        else:
+            return
 
-        return roles
+        self._recordChange(server_data.id, 'role', role_id=role.id)
 
-    def isJoinableRole(self, guild: discord.Guild, role: discord.Role) -> bool:
-        return role.id in self.getJoinableRoles(guild)
+    def roleDeleted(self, role: discord.Role):
+        server_data = self.config_data.get(role.guild.id)
+        if server_data is None:
+            return
+
+        self._role_fingerprints[server_data.id] = self.__roleFingerprint(role.guild)
+        if server_data.remove_role(role.id) is None:
+            return
+
+        self._recordChange(server_data.id, 'roleDeleted', role_id=role.id)
+
+    def memberRemoved(self, member: discord.Member):
+        server_data = self.config_data.get(member.guild.id)
+        if server_data is None:
+            return
+
+        for role_id in list(server_data.roles_commanded_by(member.id)):
+            server_data.remove_commander(role_id, member.id)
+            self._recordChange(server_data.id, 'remCommander',
+                               role_id=role_id, member_id=member.id)
 
     # Server Gating
     def getGateData(self, guild: discord.Guild):
@@ -161,6 +350,33 @@ class BaseConfigManager(object):
         else:
             return ServerGateData()
 
+    def getForumAccount(self, guild: discord.Guild, member: discord.Member) -> int:
+        return self.getGateData(guild).keyed_users.get(member.id)
+
+    def getRegisteredMembers(self, guild: discord.Guild, forum_account: int) -> List[int]:
+        return list(self.getGateData(guild).keyed_users.members_for(forum_account))
+
+    def getDuplicateRegistrations(self, guild: discord.Guild) -> Dict[int, List[int]]:
+        """Forum accounts registered by more than one member."""
+        return {forum_account: list(members) for forum_account, members
+                in self.getGateData(guild).keyed_users.duplicates().items()}
+
+    def importRegistrations(self, guild: discord.Guild, registrations: Dict[int, int]):
+        keyed_users = self.getGateData(guild).keyed_users
+        for member_id, forum_account in registrations.items():
+            keyed_users[member_id] = forum_account
+        self._recordChange(guild.id, 'gate')
+
+    def registerMember(self, guild: discord.Guild, member: discord.Member, forum_account: int):
+        self.getGateData(guild).keyed_users[member.id] = forum_account
+        self._recordChange(guild.id, 'register', member_id=member.id, forum_account=forum_account)
+
+    def unregisterMember(self, guild: discord.Guild, member: discord.Member) -> bool:
+        if self.getGateData(guild).keyed_users.pop(member.id, None) is None:
+            return False
+        self._recordChange(guild.id, 'unregister', member_id=member.id)
+        return True
+
     def setGateData(self, guild: discord.Guild, gateEnabled: bool, allowRejoin: bool, keyRoleId: str, keyedUsers: Dict[int, int]):
         server_data = self.config_data[guild.id] if self.config_data[guild.id] is not None else ServerData.from_discord_guild(
             guild)
@@ -168,8 +384,11 @@ class BaseConfigManager(object):
         server_data.gate_data = ServerGateData(
             gateEnabled, allowRejoin, keyRoleId, keyedUsers)
         self.config_data[guild.id] = server_data
-        self.writeConfig()
+        self._recordChange(guild.id, 'gate')
 
     # Utility Functions
+    def __roleFingerprint(self, guild: discord.Guild) -> int:
+        return hash(tuple((role.id, role.name) for role in guild.roles))
+
     def __formatMemberName(self, member: discord.Member):
         return member.name + '@#' + member.discriminator
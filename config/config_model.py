@@ -1,143 +1,308 @@
-from typing import Dict, List
+from typing import (AbstractSet, Any, Callable, Dict, Iterable, Iterator,
+                    Mapping, MutableMapping, Set, Tuple)
 
 import discord
 
+# The model classes use __slots__ and plain attributes: a large fleet holds
+# hundreds of thousands of these, and permission checks read them on every
+# command.
+
+
+class KeyedUsers(MutableMapping[int, int]):
+    """Maps member ids to the forum account each registered, with a reverse
+    index from forum account to members. Ids are always stored as ints."""
+    __slots__ = ('_accounts', '_members', '_duplicates')
+
+    def __init__(self, registrations: Iterable[Tuple[Any, Any]] = ()):
+        self._accounts: Dict[int, int] = {}
+        self._members: Dict[int, Set[int]] = {}
+        # Forum accounts registered by more than one member.
+        self._duplicates: Set[int] = set()
+        for member_id, forum_account in registrations:
+            self[member_id] = forum_account
+
+    def members_for(self, forum_account: int) -> AbstractSet[int]:
+        return self._members.get(int(forum_account), frozenset())
+
+    def duplicates(self) -> Dict[int, AbstractSet[int]]:
+        return {forum_account: self._members[forum_account] for forum_account in self._duplicates}
+
+    def __getitem__(self, member_id: int) -> int:
+        return self._accounts[self.__key(member_id)]
+
+    def __setitem__(self, member_id: int, forum_account: int):
+        member_id = int(member_id)
+        forum_account = int(forum_account)
+        if member_id in self._accounts:
+            del self[member_id]
+        self._accounts[member_id] = forum_account
+        members = self._members.setdefault(forum_account, set())
+        members.add(member_id)
+        if len(members) > 1:
+            self._duplicates.add(forum_account)
+
+    def __delitem__(self, member_id: int):
+        member_id = self.__key(member_id)
+        forum_account = self._accounts.pop(member_id)
+        members = self._members[forum_account]
+        members.discard(member_id)
+        if len(members) < 2:
+            self._duplicates.discard(forum_account)
+        if not members:
+            del self._members[forum_account]
+
+    def __contains__(self, member_id) -> bool:
+        try:
+            return self.__key(member_id) in self._accounts
+        except KeyError:
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._accounts)
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def __repr__(self) -> str:
+        return 'KeyedUsers(' + repr(self._accounts) + ')'
+
+    @staticmethod
+    def __key(member_id) -> int:
+        # Ids that aren't numbers are simply absent, so get() and pop()
+        # defaults work.
+        try:
+            return int(member_id)
+        except (TypeError, ValueError):
+            raise KeyError(member_id)
 
-class ServerGateData:
-    @property
-    def gate_enabled(self) -> bool:
-        return self._gate_enabled
-
-    @gate_enabled.setter
-    def gate_enabled(self, value: bool):
-        self._gate_enabled = value
-
-    @property
-    def allow_rejoin(self) -> bool:
-        return self._allow_rejoin
 
-    @allow_rejoin.setter
-    def allow_rejoin(self, value: bool):
-        self._allow_rejoin = value
-
-    @property
-    def key_role_id(self) -> int:
-        return self._key_role_id
+class ServerGateData:
+    __slots__ = ('gate_enabled', 'allow_rejoin', 'key_role_id', '_keyed_users')
 
-    @key_role_id.setter
-    def key_role_id(self, value: int):
-        self._key_role_id = value
+    gate_enabled: bool
+    allow_rejoin: bool
+    key_role_id: int
 
     @property
-    def keyed_users(self) -> Dict[int, int]:
+    def keyed_users(self) -> KeyedUsers:
         return self._keyed_users
 
     @keyed_users.setter
-    def keyed_users(self, value: Dict[int, int]):
-        self._keyed_users = value
+    def keyed_users(self, value):
+        if isinstance(value, KeyedUsers):
+            self._keyed_users = value
+        else:
+            self._keyed_users = KeyedUsers(value.items() if isinstance(value, Mapping) else value)
 
-    def __init__(self, gate_enabled=False, allow_rejoin=False, key_role_id=0, keyed_users: Dict[int, int] = {}):
+    def __init__(self, gate_enabled=False, allow_rejoin=False, key_role_id=0, keyed_users: Dict[int, int] = None):
         self.gate_enabled = gate_enabled
         self.allow_rejoin = allow_rejoin
         self.key_role_id = key_role_id
-        self.keyed_users = keyed_users
+        self.keyed_users = keyed_users if keyed_users is not None else KeyedUsers()
 
+    def to_json(self) -> dict:
+        return {
+            'gate_enabled': self.gate_enabled,
+            'allow_rejoin': self.allow_rejoin,
+            'key_role_id': self.key_role_id,
+            'keyed_users': dict(self._keyed_users)
+        }
 
-class ServerRoleData:
-    @property
-    def id(self) -> int:
-        return self._id
-
-    @id.setter
-    def id(self, value: int):
-        self._id = value
-
-    @property
-    def name(self) -> str:
-        return self._name
 
-    @name.setter
-    def name(self, value: str):
-        self._name = value
-
-    @property
-    def can_join(self) -> bool:
-        return self._can_join
+class ServerRoleData:
+    __slots__ = ('id', 'name', 'can_join', '_commanders')
 
-    @can_join.setter
-    def can_join(self, value: bool):
-        self._can_join = value
+    id: int
+    name: str
+    can_join: bool
 
     @property
-    def commanders(self) -> List[int]:
+    def commanders(self) -> Tuple[int, ...]:
+        # Kept as a tuple in the order commanders were added: most roles have
+        # none, and the empty tuple is shared. O(1) permission checks go
+        # through ServerData's member index instead.
         return self._commanders
 
     @commanders.setter
-    def commanders(self, value: List[int]):
-        self._commanders = value
+    def commanders(self, value: Iterable[int]):
+        self._commanders = tuple(dict.fromkeys(value))
 
-    def __init__(self, id: int, name: str, can_join=False, commanders: List[int] = []):
+    def __init__(self, id: int, name: str, can_join=False, commanders: Iterable[int] = ()):
         self.id = id
         self.name = name
         self.can_join = can_join
         self.commanders = commanders
 
+    def add_commander(self, member_id: int) -> bool:
+        if member_id in self._commanders:
+            return False
+        self._commanders += (member_id,)
+        return True
+
+    def remove_commander(self, member_id: int) -> bool:
+        if member_id not in self._commanders:
+            return False
+        self._commanders = tuple(
+            commander for commander in self._commanders if commander != member_id)
+        return True
+
     @classmethod
     def from_discord_role(cls, role: discord.Role):
         return cls(role.id, role.name)
 
+    def to_json(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'can_join': self.can_join,
+            'commanders': list(self._commanders)
+        }
 
-class ServerData:
-    @property
-    def id(self) -> int:
-        return self._id
-
-    @id.setter
-    def id(self, value: int):
-        self._id = value
-
-    @property
-    def name(self) -> str:
-        return self._name
-
-    @name.setter
-    def name(self, value: str):
-        self._name = value
-
-    @property
-    def greeting_message(self) -> str:
-        return self._greeting_message
-
-    @greeting_message.setter
-    def greeting_message(self, value: str):
-        self._greeting_message = value
 
-    @property
-    def gate_data(self) -> ServerGateData:
-        return self._gate_data
+class ServerData:
+    __slots__ = ('id', 'name', 'greeting_message', 'gate_data',
+                 '_role_data', '_joinable_roles', '_commanded_roles')
 
-    @gate_data.setter
-    def gate_data(self, value: ServerGateData):
-        self._gate_data = value
+    id: int
+    name: str
+    greeting_message: str
+    gate_data: ServerGateData
 
     @property
-    def role_data(self) -> ServerRoleData:
+    def role_data(self) -> Dict[int, ServerRoleData]:
         return self._role_data
 
     @role_data.setter
-    def role_data(self, value: ServerRoleData):
+    def role_data(self, value: Dict[int, ServerRoleData]):
         self._role_data = value
+        self._joinable_roles: Set[int] = {
+            role_id for role_id, role in value.items() if role.can_join}
+        self._commanded_roles: Dict[int, Set[int]] = {}
+        for role in value.values():
+            for member_id in role._commanders:
+                self._commanded_roles.setdefault(member_id, set()).add(role.id)
 
-    def __init__(self, id: int, name: str, greeting_message="", gate_data=ServerGateData(), role_data: Dict[int, ServerRoleData] = {}):
+    @property
+    def joinable_roles(self) -> Set[int]:
+        return self._joinable_roles
+
+    def __init__(self, id: int, name: str, greeting_message="", gate_data: ServerGateData = None, role_data: Dict[int, ServerRoleData] = None):
         self.id = id
         self.name = name
         self.greeting_message = greeting_message
-        self.gate_data = gate_data
-        self.role_data = role_data
+        self.gate_data = gate_data if gate_data is not None else ServerGateData()
+        self.role_data = role_data if role_data is not None else {}
 
     @classmethod
     def from_discord_guild(cls, guild: discord.Guild):
-        return cls(guild.id, guild.name, "", ServerGateData(), {})
-
-
-ConfigData = Dict[int, ServerData]
+        return cls(guild.id, guild.name)
+
+    # Roles should be changed through these so the joinable and commander
+    # indexes stay in step.
+    def set_role(self, role: ServerRoleData):
+        self.remove_role(role.id)
+        self._role_data[role.id] = role
+        if role.can_join:
+            self._joinable_roles.add(role.id)
+        for member_id in role._commanders:
+            self._commanded_roles.setdefault(member_id, set()).add(role.id)
+
+    def remove_role(self, role_id: int) -> ServerRoleData:
+        role = self._role_data.pop(role_id, None)
+        if role is not None:
+            self._joinable_roles.discard(role_id)
+            for member_id in role._commanders:
+                self.__unindex_commander(role_id, member_id)
+        return role
+
+    def set_role_joinable(self, role_id: int, joinable: bool):
+        self._role_data[role_id].can_join = joinable
+        if joinable:
+            self._joinable_roles.add(role_id)
+        else:
+            self._joinable_roles.discard(role_id)
+
+    def add_commander(self, role_id: int, member_id: int):
+        if self._role_data[role_id].add_commander(member_id):
+            self._commanded_roles.setdefault(member_id, set()).add(role_id)
+
+    def remove_commander(self, role_id: int, member_id: int):
+        if self._role_data[role_id].remove_commander(member_id):
+            self.__unindex_commander(role_id, member_id)
+
+    def is_commander(self, role_id: int, member_id: int) -> bool:
+        return role_id in self._commanded_roles.get(member_id, ())
+
+    def roles_commanded_by(self, member_id: int) -> AbstractSet[int]:
+        return self._commanded_roles.get(member_id, frozenset())
+
+    def commander_ids(self) -> AbstractSet[int]:
+        """Every member who commands at least one role."""
+        return self._commanded_roles.keys()
+
+    def __unindex_commander(self, role_id: int, member_id: int):
+        roles = self._commanded_roles.get(member_id)
+        if roles is not None:
+            roles.discard(role_id)
+            if not roles:
+                del self._commanded_roles[member_id]
+
+    def to_json(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'greeting_message': self.greeting_message,
+            'gate_data': self.gate_data.to_json(),
+            'role_data': {role_id: role.to_json() for role_id, role in self._role_data.items()}
+        }
+
+
+class LazyConfigData(MutableMapping[int, ServerData]):
+    """Maps server ids to ServerData, building each entry from its raw form
+    the first time it is accessed."""
+
+    def __init__(self, loader: Callable[[int, Any], ServerData]):
+        self._loader = loader
+        self._raw: Dict[int, Any] = {}
+        self._loaded: Dict[int, ServerData] = {}
+
+    def add_raw(self, server_id: int, data: Any):
+        self._loaded.pop(server_id, None)
+        self._raw[server_id] = data
+
+    def raw_data(self, server_id: int) -> Any:
+        return self._raw.get(server_id)
+
+    def is_loaded(self, server_id: int) -> bool:
+        return server_id in self._loaded
+
+    def __getitem__(self, server_id: int) -> ServerData:
+        server = self._loaded.get(server_id)
+        if server is None:
+            server = self._loader(server_id, self._raw[server_id])
+            del self._raw[server_id]
+            self._loaded[server_id] = server
+        return server
+
+    def __setitem__(self, server_id: int, server: ServerData):
+        self._raw.pop(server_id, None)
+        self._loaded[server_id] = server
+
+    def __delitem__(self, server_id: int):
+        if self._raw.pop(server_id, None) is None:
+            del self._loaded[server_id]
+        else:
+            self._loaded.pop(server_id, None)
+
+    def __contains__(self, server_id) -> bool:
+        return server_id in self._loaded or server_id in self._raw
+
+    def __iter__(self) -> Iterator[int]:
+        yield from list(self._loaded.keys())
+        yield from list(self._raw.keys())
+
+    def __len__(self) -> int:
+        return len(self._loaded) + len(self._raw)
+
+
+ConfigData = MutableMapping[int, ServerData]
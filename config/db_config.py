@@ -0,0 +1,325 @@
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from os import path
+from typing import Dict, List, Set
+
+import discord
+
+from metrics import metrics
+
+from .config_manager import BaseConfigManager
+from .config_model import (ConfigData, LazyConfigData, ServerData,
+                           ServerGateData, ServerRoleData)
+from .file_config import JsonObjectReader, ServerDataFile
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    greeting_message TEXT NOT NULL DEFAULT '',
+    gate_enabled INTEGER NOT NULL DEFAULT 0,
+    allow_rejoin INTEGER NOT NULL DEFAULT 0,
+    key_role_id INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS roles (
+    guild_id INTEGER NOT NULL REFERENCES servers (id) ON DELETE CASCADE,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    can_join INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS roles_joinable ON roles (guild_id) WHERE can_join;
+CREATE TABLE IF NOT EXISTS commanders (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, role_id, member_id),
+    FOREIGN KEY (guild_id, role_id) REFERENCES roles (guild_id, id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS commanders_member ON commanders (guild_id, member_id);
+CREATE TABLE IF NOT EXISTS keyed_users (
+    guild_id INTEGER NOT NULL REFERENCES servers (id) ON DELETE CASCADE,
+    member_id INTEGER NOT NULL,
+    forum_account INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, member_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keyed_users_forum ON keyed_users (guild_id, forum_account);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    origin TEXT NOT NULL,
+    changed_at REAL NOT NULL
+);
+"""
+
+
+class DbConfigManager(BaseConfigManager):
+    """Stores config data in SQLite. Each mutation is written as its own small
+    transaction, and permission lookups are answered from the indexes without
+    loading the guild.
+
+    With shared set, several processes may use the same database: every write
+    also appends the guild to the changes table, and the change feed reloads
+    guilds that other processes have written."""
+    db_path = 'data/config.db'
+    config_path = 'data/config.json'
+    # Seconds a change is kept for other processes to see.
+    change_retention = 3600.0
+
+    def __init__(self, save_interval: float = 10.0, shared: bool = False):
+        # Set before the base constructor calls readConfig.
+        self.shared = shared
+        self.origin = uuid.uuid4().hex
+        self._last_change = 0
+        self._last_prune = 0.0
+        self._change_task: asyncio.Task = None
+        super().__init__(save_interval)
+
+    def readConfig(self):
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript(SCHEMA)
+
+        if self.db.execute('SELECT 1 FROM servers LIMIT 1').fetchone() is None and path.exists(self.config_path):
+            self.__migrateFromFile()
+
+        # Guilds are only loaded from the DB when first accessed.
+        self.config_data: ConfigData = LazyConfigData(self.__loadServer)
+        for (server_id,) in self.db.execute('SELECT id FROM servers'):
+            self.config_data.add_raw(server_id, server_id)
+        # Everything changed so far was just read.
+        self._last_change = self.db.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def writeConfig(self, guild_ids: Set[int] = None):
+        # Changes are written as they happen; this only rewrites guilds that
+        # are already in memory.
+        server_ids = guild_ids if guild_ids is not None else list(self.config_data)
+        with self.db:
+            for server_id in server_ids:
+                if server_id in self.config_data and self.config_data.is_loaded(server_id):
+                    self.__writeServer(self.config_data[server_id])
+                    self.__noteChange(server_id)
+
+    async def write_config_async(self, guild_ids: Set[int] = None):
+        # The connection belongs to the loop thread, and single-row writes are
+        # cheap enough to run there.
+        self.writeConfig(guild_ids)
+
+    async def close(self):
+        if self._change_task is not None:
+            self._change_task.cancel()
+            self._change_task = None
+        await super().close()
+        self.db.close()
+
+    # Change feed
+    def startChangeFeed(self, interval: float = 2.0):
+        if self._change_task is None or self._change_task.done():
+            self._change_task = asyncio.ensure_future(self.__changeFeedLoop(interval))
+
+    def pollChanges(self) -> int:
+        """Reloads guilds that other processes have written since the last
+        poll. Returns how many were reloaded."""
+        rows = self.db.execute(
+            'SELECT seq, guild_id, origin FROM changes WHERE seq > ? ORDER BY seq',
+            (self._last_change,)).fetchall()
+        if len(rows) == 0:
+            return 0
+        self._last_change = rows[-1][0]
+
+        changed = {guild_id for _, guild_id, origin in rows if origin != self.origin}
+        for guild_id in changed:
+            if guild_id in self._dirty_guilds:
+                # Our pending rewrite of the guild supersedes theirs.
+                continue
+            if self.db.execute('SELECT 1 FROM servers WHERE id = ?', (guild_id,)).fetchone() is None:
+                if guild_id in self.config_data:
+                    del self.config_data[guild_id]
+            else:
+                # Dropped from memory; loaded again from the DB on next access.
+                self.config_data.add_raw(guild_id, guild_id)
+        metrics.increment('config_changes_applied', len(changed))
+        return len(changed)
+
+    def pruneChanges(self):
+        with self.db:
+            self.db.execute('DELETE FROM changes WHERE changed_at < ?',
+                            (time.time() - self.change_retention,))
+        self._last_prune = time.time()
+
+    async def __changeFeedLoop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.pollChanges()
+                if time.time() - self._last_prune > self.change_retention / 6:
+                    self.pruneChanges()
+            except sqlite3.Error as ex:
+                log.warning('Unable to read config changes: %s', ex)
+
+    def __noteChange(self, guild_id: int):
+        if self.shared:
+            self.db.execute(
+                'INSERT INTO changes (guild_id, origin, changed_at) VALUES (?, ?, ?)',
+                (guild_id, self.origin, time.time()))
+
+    def _recordChange(self, guild_id: int, change: str, **fields):
+        # Each change is its own transaction, timed as config_record.
+        start = time.perf_counter()
+        with self.db:
+            if change == 'addCommander':
+                self.__ensureRole(guild_id, fields['role_id'])
+                self.db.execute(
+                    'INSERT OR IGNORE INTO commanders (guild_id, role_id, member_id) VALUES (?, ?, ?)',
+                    (guild_id, fields['role_id'], fields['member_id']))
+            elif change == 'remCommander':
+                self.db.execute(
+                    'DELETE FROM commanders WHERE guild_id = ? AND role_id = ? AND member_id = ?',
+                    (guild_id, fields['role_id'], fields['member_id']))
+            elif change == 'joinable':
+                self.__ensureRole(guild_id, fields['role_id'])
+                self.db.execute(
+                    'UPDATE roles SET can_join = ? WHERE guild_id = ? AND id = ?',
+                    (int(fields['can_join']), guild_id, fields['role_id']))
+            elif change == 'role':
+                role = self.config_data[guild_id].role_data[fields['role_id']]
+                self.__ensureRole(guild_id, role.id)
+                self.db.execute(
+                    'UPDATE roles SET name = ? WHERE guild_id = ? AND id = ?',
+                    (role.name, guild_id, role.id))
+            elif change == 'roleDeleted':
+                self.db.execute(
+                    'DELETE FROM roles WHERE guild_id = ? AND id = ?',
+                    (guild_id, fields['role_id']))
+            elif change == 'register':
+                self.db.execute(
+                    'INSERT OR REPLACE INTO keyed_users (guild_id, member_id, forum_account) VALUES (?, ?, ?)',
+                    (guild_id, fields['member_id'], fields['forum_account']))
+            elif change == 'unregister':
+                self.db.execute(
+                    'DELETE FROM keyed_users WHERE guild_id = ? AND member_id = ?',
+                    (guild_id, fields['member_id']))
+            elif change == 'greeting':
+                self.__writeServerRow(self.config_data[guild_id])
+            elif change == 'gate':
+                self.__writeServerRow(self.config_data[guild_id])
+                self.__writeKeyedUsers(self.config_data[guild_id])
+            else:
+                self.__writeServer(self.config_data[guild_id])
+            self.__noteChange(guild_id)
+        metrics.observe('config_record', time.perf_counter() - start)
+
+    # Indexed lookups
+    def isCommander(self, guild: discord.Guild, role: discord.Role, member: discord.Member) -> bool:
+        row = self.db.execute(
+            'SELECT 1 FROM commanders WHERE guild_id = ? AND role_id = ? AND member_id = ?',
+            (guild.id, role.id, member.id)).fetchone()
+        return row is not None
+
+    def isJoinableRole(self, guild: discord.Guild, role: discord.Role) -> bool:
+        row = self.db.execute(
+            'SELECT can_join FROM roles WHERE guild_id = ? AND id = ?',
+            (guild.id, role.id)).fetchone()
+        return row is not None and bool(row[0])
+
+    def getCommandedRoles(self, guild: discord.Guild, member: discord.Member) -> List[int]:
+        return [role_id for (role_id,) in self.db.execute(
+            'SELECT role_id FROM commanders WHERE guild_id = ? AND member_id = ?',
+            (guild.id, member.id))]
+
+    def getForumAccount(self, guild: discord.Guild, member: discord.Member) -> int:
+        row = self.db.execute(
+            'SELECT forum_account FROM keyed_users WHERE guild_id = ? AND member_id = ?',
+            (guild.id, member.id)).fetchone()
+        return row[0] if row is not None else None
+
+    def getRegisteredMembers(self, guild: discord.Guild, forum_account: int) -> List[int]:
+        return [member_id for (member_id,) in self.db.execute(
+            'SELECT member_id FROM keyed_users WHERE guild_id = ? AND forum_account = ?',
+            (guild.id, forum_account))]
+
+    def getDuplicateRegistrations(self, guild: discord.Guild) -> Dict[int, List[int]]:
+        duplicates: Dict[int, List[int]] = {}
+        for forum_account, member_id in self.db.execute(
+                'SELECT forum_account, member_id FROM keyed_users WHERE guild_id = ? AND forum_account IN '
+                '(SELECT forum_account FROM keyed_users WHERE guild_id = ? '
+                'GROUP BY forum_account HAVING COUNT(*) > 1)', (guild.id, guild.id)):
+            duplicates.setdefault(forum_account, []).append(member_id)
+        return duplicates
+
+    # Rows
+    def __loadServer(self, server_id: int, _) -> ServerData:
+        row = self.db.execute(
+            'SELECT name, greeting_message, gate_enabled, allow_rejoin, key_role_id FROM servers WHERE id = ?',
+            (server_id,)).fetchone()
+        name, greeting_message, gate_enabled, allow_rejoin, key_role_id = row
+
+        role_data = {}
+        for role_id, role_name, can_join in self.db.execute(
+                'SELECT id, name, can_join FROM roles WHERE guild_id = ?', (server_id,)):
+            role_data[role_id] = ServerRoleData(role_id, role_name, bool(can_join), [])
+        for role_id, member_id in self.db.execute(
+                'SELECT role_id, member_id FROM commanders WHERE guild_id = ?', (server_id,)):
+            role_data[role_id].add_commander(member_id)
+
+        keyed_users = dict(self.db.execute(
+            'SELECT member_id, forum_account FROM keyed_users WHERE guild_id = ?', (server_id,)))
+        gate_data = ServerGateData(bool(gate_enabled), bool(allow_rejoin), key_role_id, keyed_users)
+
+        return ServerData(server_id, name, greeting_message, gate_data, role_data)
+
+    def __writeServerRow(self, server: ServerData):
+        gate_data = server.gate_data
+        self.db.execute(
+            'INSERT INTO servers (id, name, greeting_message, gate_enabled, allow_rejoin, key_role_id) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name, '
+            'greeting_message = excluded.greeting_message, gate_enabled = excluded.gate_enabled, '
+            'allow_rejoin = excluded.allow_rejoin, key_role_id = excluded.key_role_id',
+            (server.id, server.name, server.greeting_message or '', int(gate_data.gate_enabled),
+             int(gate_data.allow_rejoin), int(gate_data.key_role_id)))
+
+    def __writeKeyedUsers(self, server: ServerData):
+        self.db.execute('DELETE FROM keyed_users WHERE guild_id = ?', (server.id,))
+        self.db.executemany(
+            'INSERT INTO keyed_users (guild_id, member_id, forum_account) VALUES (?, ?, ?)',
+            [(server.id, int(member_id), int(forum_account))
+             for member_id, forum_account in server.gate_data.keyed_users.items()])
+
+    def __writeServer(self, server: ServerData):
+        self.__writeServerRow(server)
+        self.__writeKeyedUsers(server)
+        # Deleting the roles cascades to their commanders.
+        self.db.execute('DELETE FROM roles WHERE guild_id = ?', (server.id,))
+        self.db.executemany(
+            'INSERT INTO roles (guild_id, id, name, can_join) VALUES (?, ?, ?, ?)',
+            [(server.id, role.id, role.name, int(role.can_join)) for role in server.role_data.values()])
+        self.db.executemany(
+            'INSERT OR IGNORE INTO commanders (guild_id, role_id, member_id) VALUES (?, ?, ?)',
+            [(server.id, role.id, commander)
+             for role in server.role_data.values() for commander in role.commanders])
+
+    def __ensureRole(self, guild_id: int, role_id: int):
+        role = self.config_data[guild_id].role_data[role_id]
+        self.db.execute(
+            'INSERT OR IGNORE INTO servers (id, name) VALUES (?, ?)',
+            (guild_id, self.config_data[guild_id].name))
+        self.db.execute(
+            'INSERT OR IGNORE INTO roles (guild_id, id, name, can_join) VALUES (?, ?, ?, ?)',
+            (guild_id, role.id, role.name, int(role.can_join)))
+
+    def __migrateFromFile(self):
+        log.info('Migrating %s to %s', self.config_path, self.db_path)
+        count = 0
+        with open(self.config_path, 'r') as f, self.db:
+            for key, value in JsonObjectReader(f).items():
+                if key.isdigit():
+                    self.__writeServer(ServerDataFile.from_json(int(key), value))
+                    count += 1
+        log.info('Migrated %d guilds', count)
@@ -1,14 +1,26 @@
-import inspect
+import asyncio
 import json
-from os import getcwd, path
-from typing import Dict, List
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from os import path
+from typing import Any, Dict, Iterator, List, Set, TextIO, Tuple
+
+from metrics import metrics
 
 from .config_manager import BaseConfigManager
-from .config_model import (ConfigData, ServerData, ServerGateData,
-                           ServerRoleData)
+from .config_model import (ConfigData, KeyedUsers, LazyConfigData, ServerData,
+                           ServerGateData, ServerRoleData)
+
+log = logging.getLogger(__name__)
 
 
 class ServerGateDataFile(ServerGateData):
+    __slots__ = ()
+
     @classmethod
     def from_json(cls, data: dict):
         # Data might be in the old format
@@ -21,25 +33,20 @@ class ServerGateDataFile(ServerGateData):
         if key_role_id == "" or key_role_id is None:
             key_role_id = "0"
         
-        keyed_users: Dict[str, str] = dict()
-        if data.get("keyedUser") is not None:
-            keyed_users = data["keyedUsers"]
-        elif data.get("keyed_users") is not None:
-            keyed_users_raw = data.get("keyed_users")
+        keyed_users = KeyedUsers()
+        keyed_users_raw = data["keyedUsers"] if data.get(
+            "keyedUsers") is not None else data.get("keyed_users")
+        if keyed_users_raw is not None:
+            # JSON object keys are always strings; the registry stores ints.
             for key in keyed_users_raw:
-                keyed_users[str(key)] = str(keyed_users_raw[key])
-        
-        return cls(bool(gate_enabled), bool(allow_rejoin), int(key_role_id), keyed_users)
+                keyed_users[int(key)] = int(keyed_users_raw[key])
 
-    # def to_json(self):
-    #     obj_json = dict()
-    #     obj_json['allow_rejoin'] = self.allow_rejoin
-    #     obj_json['gate_enabled'] = self.gate_enabled
-    #     obj_json['key_role_id'] = self.key_role_id
-    #     obj_json['keyed_users'] = self.keyed_users
+        return cls(bool(gate_enabled), bool(allow_rejoin), int(key_role_id), keyed_users)
 
 
 class ServerRoleDataFile(ServerRoleData):
+    __slots__ = ()
+
     @classmethod
     def from_json(cls, id: int, data: dict):
         # Data might be in the old format
@@ -47,9 +54,9 @@ class ServerRoleDataFile(ServerRoleData):
             "canJoin") is not None else data.get("can_join")
 
         commanders: List[int] = []
-        if isinstance(data["commanders"], list):
+        if isinstance(data.get("commanders"), list):
             commanders = data["commanders"]
-        elif isinstance(data["commanders"], dict):
+        elif isinstance(data.get("commanders"), dict):
             for key in data["commanders"].keys():
                 if int(key) > 0:
                     commanders.append(int(key))
@@ -74,6 +81,8 @@ class ServerRoleDataFile(ServerRoleData):
 
 
 class ServerDataFile(ServerData):
+    __slots__ = ()
+
     @ classmethod
     def from_json(cls, id, data: dict):
         # Data might be in the old format.
@@ -84,7 +93,10 @@ class ServerDataFile(ServerData):
         role_data = data["roleData"] if data.get(
             "roleData") is not None else data.get("role_data")
 
-        return cls(id, str(data["name"]), str(greeting_message), ServerGateDataFile.from_json(gate_data), ServerRoleDataFile.from_json_list(role_data))
+        if greeting_message is None:
+            greeting_message = ""
+
+        return cls(id, str(data["name"]), str(greeting_message), ServerGateDataFile.from_json(gate_data or {}), ServerRoleDataFile.from_json_list(role_data or {}))
 
     @classmethod
     def from_json_list(cls, data: dict) -> Dict[int, ServerData]:
@@ -101,43 +113,294 @@ class ServerDataFile(ServerData):
         return servers
 
 
-class ObjectEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if hasattr(obj, "to_json"):
-            return self.default(obj.to_json())
-        elif hasattr(obj, "__dict__"):
-            d = dict(
-                (key, value)
-                for key, value in inspect.getmembers(obj)
-                if not key.startswith("_")
-                and not inspect.isabstract(value)
-                and not inspect.isbuiltin(value)
-                and not inspect.isfunction(value)
-                and not inspect.isgenerator(value)
-                and not inspect.isgeneratorfunction(value)
-                and not inspect.ismethod(value)
-                and not inspect.ismethoddescriptor(value)
-                and not inspect.isroutine(value)
-            )
-            return self.default(d)
-        return obj
+class JsonObjectReader:
+    """Reads the members of a top-level JSON object one at a time, without
+    holding the whole document in memory."""
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 16):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        self._expect('{')
+        if self._peek() == '}':
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(':')
+            yield key, self._decode()
+
+            token = self._peek()
+            self._pos += 1
+            if token == '}':
+                return
+            elif token != ',':
+                raise ValueError('Expected , or } in JSON object, got ' + repr(token))
+
+    def _read(self) -> bool:
+        if self._eof:
+            return False
+        # Grow the read size with the buffer so a large value isn't re-parsed
+        # once per small chunk.
+        chunk = self._file.read(max(self._chunk_size, len(self._buffer)))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return ''
+
+    def _expect(self, token: str):
+        found = self._peek()
+        if found != token:
+            raise ValueError('Expected ' + token + ' in JSON object, got ' + repr(found))
+        self._pos += 1
+
+    def _decode(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk.
+            if end == len(self._buffer) and self._read():
+                continue
+            self._pos = end
+            return value
+
+
+def write_file_atomic(file_path: str, text: str):
+    # Write to a temp file next to the target and rename it over the top, so
+    # a crash mid-write leaves the previous file intact.
+    directory = path.dirname(path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        # mkstemp creates the file as 0600; keep the target's permissions.
+        mode = os.stat(file_path).st_mode if path.exists(file_path) else 0o644
+        os.chmod(temp_path, mode & 0o777)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
 
 class FileConfigManager(BaseConfigManager):
+    config_path = 'data/config.json'
+    journal_path = 'data/config.journal'
+
+    def __init__(self, save_interval: float = 10.0, compact: bool = False,
+                 journal: bool = False, journal_compact_records: int = 1000):
+        self.compact = compact
+        self.journal = journal
+        self.journal_compact_records = journal_compact_records
+        self._journal_file: TextIO = None
+        self._journal_records = 0
+        self._journal_unsynced = False
+        self._write_lock = threading.Lock()
+        # Each loaded guild's JSON as of the last snapshot, dropped whenever
+        # the guild changes.
+        self._snapshot_cache: Dict[int, dict] = {}
+        super().__init__(save_interval)
+
     def readConfig(self):
+        # Guilds are kept as parsed JSON until first accessed.
+        self.config_data: ConfigData = LazyConfigData(ServerDataFile.from_json)
         try:
-            print(getcwd())
-            f = open('data/config.json', 'r')
-            print(path.realpath(f.name))
-            servers = ServerDataFile.from_json_list(json.load(f))
-            self.config_data: ConfigData = {
-                server_id: servers[server_id] for server_id in servers.keys()}
+            with open(self.config_path, 'r') as f:
+                log.debug('Reading %s', path.realpath(f.name))
+                for key, value in JsonObjectReader(f).items():
+                    if key.isdigit():
+                        self.config_data.add_raw(int(key), value)
         except Exception as ex:
-            self.config_data: ConfigData = {}
+            log.warning('Unable to read Config Data: %s', ex)
+            self.config_data = LazyConfigData(ServerDataFile.from_json)
+
+        if self.journal:
+            self.__replayJournal()
+            self._journal_file = open(self.journal_path, 'a')
 
         return
 
-    def writeConfig(self):
-        f = open('data/config.json',  'w')
+    def writeConfig(self, guild_ids: Set[int] = None):
+        snapshot = self._snapshotConfig(guild_ids)
+        self.__rotateJournal()
+        self._writeSnapshot(snapshot)
+
+    async def write_config_async(self, guild_ids: Set[int] = None):
+        # The snapshot walks the live config objects, so it has to be taken on
+        # the loop; encoding and file I/O are handed to the executor.
+        snapshot = self._snapshotConfig(guild_ids)
+        self.__rotateJournal()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._io_executor, self._writeSnapshot, snapshot)
+
+    async def _writeDirty(self):
+        # Runs under the flush lock, so the journal can't be rotated and
+        # closed while it is being synced.
+        if self._journal_unsynced:
+            self._journal_unsynced = False
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self._io_executor, os.fsync, self._journal_file.fileno())
+        await super()._writeDirty()
+
+    async def close(self):
+        await super().close()
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def markDirty(self, guild_id: int):
+        self._snapshot_cache.pop(guild_id, None)
+        super().markDirty(guild_id)
+
+    # Journal
+    def _recordChange(self, guild_id: int, change: str, **fields):
+        self._snapshot_cache.pop(guild_id, None)
+        if not self.journal:
+            super()._recordChange(guild_id, change, **fields)
+            return
+
+        # Append a record of just what changed; the full snapshot is only
+        # rewritten once enough records have built up.
+        start = time.perf_counter()
+        server = self.config_data[guild_id]
+        record = {'guild': guild_id, 'change': change}
+        if change in ('addCommander', 'remCommander', 'joinable', 'role'):
+            record['role'] = server.role_data[fields['role_id']].to_json()
+        elif change in ('register', 'unregister', 'roleDeleted'):
+            record.update(fields)
+        elif change == 'greeting':
+            record['greeting_message'] = server.greeting_message
+        elif change == 'gate':
+            record['gate_data'] = server.gate_data.to_json()
+        else:
+            record['server'] = server.to_json()
+
+        self._journal_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._journal_file.flush()
+        metrics.observe('config_record', time.perf_counter() - start)
+        self._journal_unsynced = True
+        self._journal_records += 1
+        if self._journal_records >= self.journal_compact_records:
+            self.markDirty(guild_id)
+
+    def __replayJournal(self):
+        # Records from a compaction that didn't finish come first. Every record
+        # sets state rather than modifying it, so replaying records that also
+        # made it into the snapshot is harmless.
+        for journal_path in (self.journal_path + '.old', self.journal_path):
+            if not path.exists(journal_path):
+                continue
+            with open(journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning('Skipping incomplete record in %s', journal_path)
+                        continue
+                    self.__applyRecord(record)
+                    self._journal_records += 1
+
+    def __applyRecord(self, record: dict):
+        server_id = record['guild']
+        change = record['change']
+        if change == 'server':
+            self.config_data[server_id] = ServerDataFile.from_json(server_id, record['server'])
+            return
+        if server_id not in self.config_data:
+            return
+
+        server = self.config_data[server_id]
+        if 'role' in record:
+            role = ServerRoleDataFile.from_json(record['role']['id'], record['role'])
+            server.set_role(role)
+        elif change == 'roleDeleted':
+            server.remove_role(record['role_id'])
+        elif change == 'register':
+            server.gate_data.keyed_users[record['member_id']] = record['forum_account']
+        elif change == 'unregister':
+            server.gate_data.keyed_users.pop(record['member_id'], None)
+        elif change == 'greeting':
+            server.greeting_message = record['greeting_message']
+        elif change == 'gate':
+            server.gate_data = ServerGateDataFile.from_json(record['gate_data'])
+
+    def __rotateJournal(self):
+        # Move the records the new snapshot covers aside; they are deleted once
+        # the snapshot is safely on disk.
+        if not self.journal:
+            return
+
+        self._journal_file.close()
+        old_path = self.journal_path + '.old'
+        if path.exists(old_path):
+            # A previous compaction didn't finish; keep its records first.
+            with open(old_path, 'a') as old, open(self.journal_path, 'r') as current:
+                shutil.copyfileobj(current, old)
+            os.remove(self.journal_path)
+        elif path.exists(self.journal_path):
+            os.replace(self.journal_path, old_path)
+
+        self._journal_file = open(self.journal_path, 'a')
+        self._journal_records = 0
+        self._journal_unsynced = False
+
+    def _snapshotConfig(self, guild_ids: Set[int] = None) -> dict:
+        # Everything lives in one file, so every write is a full snapshot, but
+        # only guilds that changed since the last one are encoded again.
+        snapshot = {}
+        cache = {}
+        for server_id in self.config_data:
+            # Guilds that were never touched are written back as they were read.
+            raw = self.config_data.raw_data(server_id)
+            if raw is not None:
+                snapshot[server_id] = raw
+                continue
+            server_json = self._snapshot_cache.get(server_id)
+            if server_json is None or guild_ids is None or server_id in guild_ids:
+                server_json = self.config_data[server_id].to_json()
+            snapshot[server_id] = cache[server_id] = server_json
+        self._snapshot_cache = cache
+        return snapshot
+
+    def _encodeSnapshot(self, snapshot: dict) -> str:
+        if self.compact:
+            return json.dumps(snapshot, separators=(',', ':'))
+        return json.dumps(snapshot, indent=2)
 
-        json.dump(self.config_data, f, cls=ObjectEncoder, indent=2)
+    def _writeSnapshot(self, snapshot: dict):
+        text = self._encodeSnapshot(snapshot)
+        with self._write_lock:
+            write_file_atomic(self.config_path, text)
+            if self.journal and path.exists(self.journal_path + '.old'):
+                os.remove(self.journal_path + '.old')
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import shutil
+from os import path
+from typing import Set
+
+from .config_model import ConfigData, LazyConfigData, ServerData
+from .file_config import FileConfigManager, ServerDataFile, write_file_atomic
+
+log = logging.getLogger(__name__)
+
+
+class GuildFileConfigManager(FileConfigManager):
+    """Stores each guild in its own file under data/guilds, so a write only
+    touches the guilds that changed."""
+    guilds_path = 'data/guilds'
+
+    def readConfig(self):
+        if not path.isdir(self.guilds_path) and path.exists(self.config_path):
+            self.__migrateFromSingleFile()
+
+        # Guild files are only read when the guild is first accessed.
+        self.config_data: ConfigData = LazyConfigData(self.__loadGuild)
+        if not path.isdir(self.guilds_path):
+            return
+
+        for file_name in os.listdir(self.guilds_path):
+            server_id, extension = path.splitext(file_name)
+            if extension == '.json' and server_id.isdigit():
+                self.config_data.add_raw(int(server_id), path.join(self.guilds_path, file_name))
+
+    def _snapshotConfig(self, guild_ids: Set[int] = None) -> dict:
+        # A None entry means the guild was removed and its file should go too.
+        snapshot = {}
+        server_ids = guild_ids if guild_ids is not None else list(self.config_data)
+        for server_id in server_ids:
+            if server_id not in self.config_data:
+                snapshot[server_id] = None
+            elif self.config_data.is_loaded(server_id):
+                snapshot[server_id] = self.config_data[server_id].to_json()
+        return snapshot
+
+    def _writeSnapshot(self, snapshot: dict):
+        os.makedirs(self.guilds_path, exist_ok=True)
+        with self._write_lock:
+            for server_id, server_json in snapshot.items():
+                file_path = self.__guildPath(server_id)
+                if server_json is None:
+                    if path.exists(file_path):
+                        os.remove(file_path)
+                else:
+                    write_file_atomic(file_path, self._encodeSnapshot(server_json))
+
+    def __loadGuild(self, server_id: int, file_path: str) -> ServerData:
+        with open(file_path, 'r') as f:
+            return ServerDataFile.from_json(server_id, json.load(f))
+
+    def __guildPath(self, server_id: int) -> str:
+        return path.join(self.guilds_path, str(server_id) + '.json')
+
+    def __migrateFromSingleFile(self):
+        # Split the old data/config.json into one file per guild. The files are
+        # written to a temp directory that is renamed into place, so an
+        # interrupted migration is simply retried on the next start.
+        log.info('Migrating %s to %s', self.config_path, self.guilds_path)
+        super().readConfig()
+        snapshot = super()._snapshotConfig()
+
+        temp_path = self.guilds_path + '.tmp'
+        if path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        for server_id, server_json in snapshot.items():
+            write_file_atomic(path.join(temp_path, str(server_id) + '.json'),
+                              self._encodeSnapshot(server_json))
+        os.replace(temp_path, self.guilds_path)
+
+        # Keep the original alongside as a backup.
+        os.replace(self.config_path, self.config_path + '.migrated')
+        log.info('Migrated %d guilds', len(snapshot))
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Dict, List
+
+import discord
+
+from config.config_manager import BaseConfigManager
+from metrics import metrics
+from outbox import MESSAGE_LIMIT, Outbox
+
+NAME_PLACEHOLDER = '@@NAME@@'
+
+
+class GreetingTemplate:
+    """A greeting message split around its @@NAME@@ placeholders."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = source.split(NAME_PLACEHOLDER)
+
+    def render(self, mentions: List[str]) -> str:
+        return ', '.join(mentions).join(self.parts)
+
+    def rendered_length(self, mentions_length: int) -> int:
+        return len(self.source) + (len(self.parts) - 1) * (mentions_length - len(NAME_PLACEHOLDER))
+
+
+class GreetingScheduler:
+    """Greets new members after a delay. Members who join the same channel
+    within the delay are greeted together in one message."""
+
+    def __init__(self, configMgr: BaseConfigManager, outbox: Outbox, delay: float = 3.0):
+        self.configManager = configMgr
+        self.outbox = outbox
+        self.delay = delay
+        self._templates: Dict[int, GreetingTemplate] = {}
+        self._pending: Dict[int, List[discord.Member]] = {}
+
+    def schedule(self, channel: discord.TextChannel, member: discord.Member):
+        if self.__getTemplate(channel.guild) is None:
+            return
+
+        metrics.increment('greetings_scheduled')
+        pending = self._pending.get(channel.id)
+        if pending is not None:
+            pending.append(member)
+            return
+
+        # A timer rather than a sleeping coroutine per join.
+        self._pending[channel.id] = [member]
+        asyncio.get_event_loop().call_later(self.delay, self.__flush, channel)
+
+    def __flush(self, channel: discord.TextChannel):
+        members = self._pending.pop(channel.id, [])
+        template = self.__getTemplate(channel.guild)
+        if template is None or len(members) == 0:
+            return
+
+        # Mention as many members per message as fit in Discord's limit.
+        batches: List[List[str]] = [[]]
+        length = 0
+        for member in members:
+            mention = member.mention
+            added = len(mention) if len(batches[-1]) == 0 else len(mention) + 2
+            if len(batches[-1]) > 0 and template.rendered_length(length + added) > MESSAGE_LIMIT:
+                batches.append([])
+                length = 0
+                added = len(mention)
+            batches[-1].append(mention)
+            length += added
+
+        for mentions in batches:
+            metrics.increment('greetings_sent')
+            asyncio.ensure_future(self.outbox.send(channel, template.render(mentions)))
+
+    def __getTemplate(self, guild: discord.Guild) -> GreetingTemplate:
+        greeting = self.configManager.getGreetingMessage(guild)
+        if greeting is None:
+            self._templates.pop(guild.id, None)
+            return None
+
+        template = self._templates.get(guild.id)
+        if template is None or template.source != greeting:
+            template = self._templates[guild.id] = GreetingTemplate(greeting)
+        return template
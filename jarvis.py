@@ -1,63 +1,277 @@
 import discord
 import asyncio
+import logging
+import os
+import time
 from discord import message
-# import logging
 
 from discord.ext import commands
 
-from config.file_config import FileConfigManager
+from config.base_config import BaseConfig
+from config.db_config import DbConfigManager
+from config.file_config import FileConfigManager, write_file_atomic
+from config.guild_file_config import GuildFileConfigManager
 from admin import AdministrationCommands
+from greeter import GreetingScheduler
+from rekeyer import RejoinRekeyer
+from metrics import metrics, sample_loop_lag
+from outbox import Outbox
+from logs import setup_logging
+from sharding import parse_shard_ids
 
-# logger = logging.getLogger('discord')
-# logger.setLevel(logging.DEBUG)
-# handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-# handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-# logger.addHandler(handler)
+log = logging.getLogger('jarvis')
 
+settings = BaseConfig.load()
+# launcher.py starts each worker with its shard range and index.
+try:
+    shardIds = parse_shard_ids(os.environ.get('JARVIS_SHARDS', settings.shard_ids), settings.shard_count)
+    shardError = None
+except ValueError as ex:
+    # Reported by main() once logging is set up.
+    shardIds, shardError = None, str(ex)
+WORKER = os.environ.get('JARVIS_WORKER', '')
+if WORKER:
+    # Every worker gets its own metrics endpoint and files.
+    if settings.metrics_port > 0:
+        settings.metrics_port += int(WORKER)
+    if settings.metrics_file:
+        settings.metrics_file += '.' + WORKER
+    if settings.log_file:
+        settings.log_file += '.' + WORKER
 intents = discord.Intents.default()
 intents.members = True
-intents.presences = True
+# Nothing reads presence, and it is the bulk of gateway traffic.
+intents.presences = settings.presence_intent
 description = "J.A.R.V.I.S is an administration helper."
-bot = commands.Bot(command_prefix='!', description=description, intents=intents)
+COMMAND_PREFIX = '!'
+# With 'lazy', members are cached as they are seen or when a command needs
+# them, instead of requesting every guild's member list at startup.
+if settings.auto_shard or shardIds is not None:
+    # Runs several gateway connections in this process. With shard_ids, the
+    # process only connects those shards and other processes run the rest.
+    bot = commands.AutoShardedBot(command_prefix=COMMAND_PREFIX, description=description, intents=intents,
+                                  chunk_guilds_at_startup=settings.member_cache != 'lazy',
+                                  shard_count=settings.shard_count or None, shard_ids=shardIds)
+else:
+    bot = commands.Bot(command_prefix=COMMAND_PREFIX, description=description, intents=intents,
+                       chunk_guilds_at_startup=settings.member_cache != 'lazy')
 configManager = None
+greeter = None
+rekeyer = None
+metricsServer = None
+outbox = Outbox(settings.send_queue_size)
+logListener = None
+setupDone = False
+settingUp = False
+# Seconds between attempts when startup fails.
+SETUP_RETRY = 30
 
 
 @bot.event
 async def on_ready():
-    print('Logged in as')
-    print(bot.user.name)
-    print(bot.user.id)
-    print('------ Servers ------')
-    global configManager
-    configManager = FileConfigManager()
-    updateConfigs()
-    bot.add_cog(AdministrationCommands(bot,  configManager))
+    log.info('Logged in as %s (%s) to %d servers', bot.user.name, bot.user.id, len(bot.guilds))
+    # on_ready fires again after every reconnect, so only the first one sets
+    # things up.
+    if setupDone:
+        await reconcileConfigs()
+    elif not settingUp:
+        await setup()
+
+async def setup():
+    # Retried until it completes, so a failed startup sweep doesn't leave the
+    # bot running without its commands.
+    global settingUp
+    settingUp = True
+    try:
+        while True:
+            try:
+                await setupOnce()
+                return
+            except Exception:
+                log.exception('Setup failed; retrying in %ds', SETUP_RETRY)
+                await asyncio.sleep(SETUP_RETRY)
+    finally:
+        settingUp = False
+
+async def setupOnce():
+    # Every step can be repeated after a failed attempt.
+    global configManager, greeter, rekeyer, setupDone
+    if configManager is None:
+        start = time.perf_counter()
+        configManager = createConfigManager()
+        metrics.observe('startup_load', time.perf_counter() - start)
+        log.info('Config loaded in %s', formatSeconds(time.perf_counter() - start))
+    await updateConfigs()
+    configManager.startWriteBehind()
+    if shardIds is not None:
+        configManager.startChangeFeed(settings.change_poll_interval)
+    if greeter is None:
+        greeter = GreetingScheduler(configManager, outbox, settings.greeting_delay)
+    if rekeyer is None:
+        rekeyer = RejoinRekeyer(configManager, settings.rekey_concurrency)
+        rekeyer.start()
+    if bot.get_cog('AdministrationCommands') is None:
+        bot.add_cog(AdministrationCommands(bot,  configManager, settings.bulk_role_concurrency, outbox))
+    await startMetrics()
+    setupDone = True
+
+async def reconcileConfigs():
+    # Catch up on guild and role changes missed while disconnected.
+    result = await configManager.reconcileServerData(list(bot.guilds))
+    metrics.increment('reconnects')
+    metrics.observe('reconnect_reconcile', result['seconds'])
+    log.info('Reconnected: reconciled %d of %d servers in %s', result['changed'], result['guilds'],
+             formatSeconds(result['seconds']))
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    log.info('Shard %d ready', shard_id)
 
 @bot.event
 async def on_message(message: discord.Message):
     # do stuff
     if message.type == discord.MessageType.new_member : # Send a Greeting?
-        guild = message.guild
-        channel = message.channel
-        author = message.author
-        greeting = configManager.getGreetingMessage(guild)
-        if greeting != 'none' :
-            await asyncio.sleep(3)
-            await channel.send(greeting.replace('@@NAME@@', author.mention))
+        if greeter is not None:
+            greeter.schedule(message.channel, message.author)
         # Allow Rejoin, yo.
 
-    await bot.process_commands(message)
+    metrics.increment('messages_seen')
+    if isCommandCandidate(message):
+        metrics.increment('messages_dispatched')
+        await bot.process_commands(message)
+
+def isCommandCandidate(message: discord.Message) -> bool:
+    # Most messages are ordinary chat, so rule them out before discord.py
+    # builds a Context for them.
+    if message.author.bot:
+        return False
+    content = message.content
+    if not content.startswith(COMMAND_PREFIX):
+        return False
+    words = content[len(COMMAND_PREFIX):].split(None, 1)
+    if len(words) == 0:
+        return False
+    command = bot.all_commands.get(words[0])
+    if command is None:
+        return False
+    # Every cog command is guild only; only the bot-level ones (help,
+    # shutdown) work in DMs.
+    return message.guild is not None or command.cog is None
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    if configManager is not None:
+        configManager.updateServerData(guild)
+    log.info('Joined server %s', guild.name, extra={'guild': guild.id})
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    if configManager is not None:
+        configManager.roleCreated(role)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    if configManager is not None:
+        configManager.roleUpdated(after)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    if configManager is not None:
+        configManager.roleDeleted(role)
 
-def updateConfigs():
+@bot.event
+async def on_member_join(member: discord.Member):
+    if configManager is not None:
+        # A join means they had left. discord.py only reports departures of
+        # cached members, so with the lazy member cache this is where
+        # commanders who left get pruned.
+        configManager.memberRemoved(member)
+    if rekeyer is not None:
+        await rekeyer.memberJoined(member)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    if configManager is not None:
+        configManager.memberRemoved(member)
+
+async def startMetrics():
+    global metricsServer
+    asyncio.ensure_future(sample_loop_lag())
+    asyncio.ensure_future(exportMetrics())
+    if settings.metrics_port > 0:
+        # Only reachable from this machine; scrape it through a local agent.
+        try:
+            metricsServer = await asyncio.start_server(serveMetrics, '127.0.0.1', settings.metrics_port)
+        except OSError as ex:
+            log.error('Unable to serve metrics on port %d: %s', settings.metrics_port, ex)
+            return
+        log.info('Serving metrics on http://127.0.0.1:%d/metrics', settings.metrics_port)
+
+async def exportMetrics():
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(settings.metrics_interval)
+        if bot.latency == bot.latency and bot.latency != float('inf'):
+            metrics.gauge('gateway_latency_seconds', bot.latency)
+        metrics.gauge('guilds', len(bot.guilds))
+        if settings.metrics_file:
+            try:
+                await loop.run_in_executor(None, write_file_atomic, settings.metrics_file,
+                                           metrics.render_prometheus())
+            except Exception as ex:
+                log.warning('Unable to write metrics: %s', ex)
+
+async def serveMetrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Answers any request with the metrics; enough for a Prometheus scrape.
+    try:
+        await reader.readuntil(b'\r\n\r\n')
+        body = metrics.render_prometheus().encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n' +
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def createConfigManager():
+    if settings.config_backend == 'sqlite':
+        return DbConfigManager(settings.save_interval, shared=shardIds is not None)
+    if settings.config_backend == 'guild_files':
+        return GuildFileConfigManager(settings.save_interval, settings.compact_config)
+    return FileConfigManager(settings.save_interval, settings.compact_config,
+                             settings.config_journal, settings.journal_compact_records)
+
+async def updateConfigs():
     servers = list(bot.guilds)
     global configManager
-    for iServer in range(len(servers)):
-        server = servers[iServer]
-        configManager.updateServerData(server)
-        print('Updated Data for ' + server.name + ':' + str(server.id))
-    configManager.writeConfig()
-    print('Updated Config Data Written!')
+    timings = await configManager.updateAllServerData(servers)
+    for phase in timings:
+        metrics.observe('startup_' + phase, timings[phase])
+    log.info('Updated Data for %d servers (%s)', len(servers),
+             ', '.join(phase + ' ' + formatSeconds(timings[phase]) for phase in timings))
 
+def formatSeconds(seconds: float) -> str:
+    return '{:.3f}s'.format(seconds)
+
+
+closeBot = bot.close
+
+async def close():
+    # Client.run also calls this on SIGINT and SIGTERM, after cancelling every
+    # task including the write-behind loop, so pending changes are written
+    # here before disconnecting.
+    if configManager is not None:
+        await configManager.close()
+    await outbox.close()
+    if rekeyer is not None:
+        rekeyer.close()
+    if metricsServer is not None:
+        metricsServer.close()
+    await closeBot()
+    log.info('Shut down')
+
+bot.close = close
 
 @bot.command()
 @commands.is_owner()
@@ -66,13 +280,32 @@ async def shutdown(ctx):
     await bot.close()
     quit()
 
-try:
-    f = open('token.txt',  'r')
-except:
-    print('Unable to find token.txt!')
-    quit()
+def main():
+    global logListener
+    logListener = setup_logging(settings.log_level, settings.log_file)
+    if shardError is not None:
+        log.error('Invalid shard_ids: %s', shardError)
+        logListener.stop()
+        quit()
+    if shardIds is not None and settings.config_backend != 'sqlite':
+        log.error("Processes running a subset of the shards can only share the 'sqlite' config_backend")
+        logListener.stop()
+        quit()
+    try:
+        f = open('token.txt',  'r')
+    except:
+        log.error('Unable to find token.txt!')
+        logListener.stop()
+        quit()
+
+    token = f.read().strip()
+    f.close()
+    log.info('Starting')
+    try:
+        bot.run(str(token))
+    finally:
+        # Flushes whatever is still queued.
+        logListener.stop()
 
-token = f.read().strip()
-f.close()
-print('Starting with Token: |' + token + '|')
-bot.run(str(token))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Runs jarvis.py as several worker processes, each connecting a range of
+the bot's shards and sharing data/config.db.
+
+Run from the repository root: python3 launcher.py
+Reads shard_count and worker_processes from data/settings.json. A worker
+that crashes is restarted; one stopped with !shutdown is not.
+"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+from config.base_config import BaseConfig
+from logs import setup_logging
+from sharding import format_shard_ids, split_shards
+
+log = logging.getLogger('launcher')
+
+# Discord accepts one IDENTIFY every 5 seconds, so workers are started one
+# after another rather than all at once.
+IDENTIFY_INTERVAL = 5.5
+RESTART_DELAY = 10.0
+
+
+def start_worker(iWorker: int, shard_ids: List[int]) -> subprocess.Popen:
+    env = dict(os.environ, JARVIS_SHARDS=format_shard_ids(shard_ids), JARVIS_WORKER=str(iWorker))
+    log.info('Starting worker %d with shards %s', iWorker, format_shard_ids(shard_ids))
+    return subprocess.Popen([sys.executable, 'jarvis.py'], env=env)
+
+
+def main():
+    settings = BaseConfig.load()
+    listener = setup_logging(settings.log_level)
+    if settings.shard_count < 1:
+        log.error('Set shard_count in data/settings.json to run several workers')
+        listener.stop()
+        sys.exit(1)
+    if settings.config_backend != 'sqlite':
+        log.error("Workers can only share the 'sqlite' config_backend")
+        listener.stop()
+        sys.exit(1)
+
+    ranges = split_shards(settings.shard_count, settings.worker_processes)
+    workers = []
+    for iWorker, shard_ids in enumerate(ranges):
+        workers.append(start_worker(iWorker, shard_ids))
+        if iWorker < len(ranges) - 1:
+            time.sleep(IDENTIFY_INTERVAL * len(shard_ids))
+
+    try:
+        while any(worker is not None for worker in workers):
+            time.sleep(1)
+            for iWorker, worker in enumerate(workers):
+                if worker is None or worker.poll() is None:
+                    continue
+                if worker.returncode == 0:
+                    log.info('Worker %d stopped', iWorker)
+                    workers[iWorker] = None
+                else:
+                    log.warning('Worker %d exited with %d; restarting', iWorker, worker.returncode)
+                    time.sleep(RESTART_DELAY)
+                    workers[iWorker] = start_worker(iWorker, ranges[iWorker])
+    except KeyboardInterrupt:
+        for worker in workers:
+            if worker is not None:
+                worker.terminate()
+        for worker in workers:
+            if worker is not None:
+                worker.wait()
+    finally:
+        listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Tuple
+
+# Extra fields that are appended to a log line as key=value when present,
+# e.g. log.info('Joined', extra={'guild': guild.id}).
+CONTEXT_FIELDS = ('guild', 'channel', 'member', 'command')
+
+
+class ContextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = ' '.join(field + '=' + str(getattr(record, field))
+                           for field in CONTEXT_FIELDS if hasattr(record, field))
+        return line + ' ' + context if context else line
+
+
+class SamplingFilter(logging.Filter):
+    """Passes at most `burst` records per message template and logger in each
+    `interval` seconds. The next record let through reports how many were
+    dropped. Only records below WARNING are sampled, plus those logged with
+    extra={'sample': True}; everything else always passes."""
+
+    def __init__(self, burst: int = 10, interval: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (logger, template) -> (window start, passed, suppressed)
+        self._windows: Dict[Tuple[str, str], Tuple[float, int, int]] = {}
+        self._last_purge = time.monotonic()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING and not getattr(record, 'sample', False):
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        if now - self._last_purge >= self.interval:
+            self.__purge(now)
+        start, passed, suppressed = self._windows.get(key, (now, 0, 0))
+        if now - start >= self.interval:
+            start, passed = now, 0
+
+        if passed >= self.burst:
+            self._windows[key] = (start, passed, suppressed + 1)
+            return False
+
+        if suppressed > 0:
+            record.msg = str(record.msg) + ' (' + str(suppressed) + ' similar messages suppressed)'
+        self._windows[key] = (start, passed + 1, 0)
+        return True
+
+    def __purge(self, now: float):
+        # Expired windows are dropped once nothing is waiting to be reported,
+        # or after a while regardless.
+        self._windows = {key: window for key, window in self._windows.items()
+                         if now - window[0] < self.interval or
+                         (window[2] > 0 and now - window[0] < 10 * self.interval)}
+        self._last_purge = now
+
+
+def setup_logging(level: str = 'INFO', file_path: str = '') -> QueueListener:
+    """Routes all logging through a queue so callers on the event loop never
+    wait on stdout or disk. Returns the listener, which should be stopped on
+    shutdown to flush what is left."""
+    formatter = ContextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if file_path:
+        handlers.append(RotatingFileHandler(file_path, maxBytes=10 * 1024 * 1024, backupCount=3, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level.upper())
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def labelled(name: str, **labels) -> str:
+    """Returns the metric name for one set of labels, e.g.
+    command_latency{command="addRole"}."""
+    if len(labels) == 0:
+        return name
+    return name + '{' + ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+        for key, value in sorted(labels.items())) + '}'
+
+
+def split_name(name: str) -> Tuple[str, str]:
+    """Splits a labelled metric name into its base name and label list."""
+    if '{' not in name:
+        return name, ''
+    base, labels = name.split('{', 1)
+    return base, labels[:-1]
+
+
+def labels_of(name: str) -> Dict[str, str]:
+    """Returns the labels of a name built by labelled."""
+    labels = {}
+    for pair in split_name(name)[1].split('",'):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            labels[key] = value.strip('"')
+    return labels
+
+
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        # Observations per bucket; the last counts everything above the
+        # largest bound.
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+        for iBucket, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[iBucket] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given quantile."""
+        target = fraction * self.count
+        seen = 0
+        for iBucket, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if seen >= target:
+                return min(BUCKETS[iBucket], self.max)
+        return self.max
+
+
+class Metrics:
+    """Process-wide counters, gauges and timings."""
+
+    def __init__(self):
+        # Counters usually count events, but some accumulate seconds.
+        self.counters: Dict[str, float] = {}
+        self.timings: Dict[str, Timing] = {}
+        self.gauges: Dict[str, float] = {}
+        self.started = time.time()
+
+    def increment(self, name: str, amount: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = Timing()
+        timing.observe(seconds)
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def render_prometheus(self, prefix: str = 'jarvis_') -> str:
+        """Renders every metric in the Prometheus text exposition format.
+        Timings become histograms named <name>_seconds."""
+        lines: List[str] = []
+        declared = set()
+
+        def declare(base: str, kind: str):
+            if base not in declared:
+                declared.add(base)
+                lines.append('# TYPE ' + prefix + base + ' ' + kind)
+
+        for name in sorted(self.counters):
+            declare(split_name(name)[0], 'counter')
+            lines.append(prefix + name + ' ' + str(self.counters[name]))
+
+        for name in sorted(self.gauges):
+            declare(split_name(name)[0], 'gauge')
+            lines.append(prefix + name + ' ' + repr(float(self.gauges[name])))
+
+        for name in sorted(self.timings):
+            base, labels = split_name(name)
+            base += '_seconds'
+            timing = self.timings[name]
+            declare(base, 'histogram')
+            separator = ',' if labels else ''
+            cumulative = 0
+            for iBucket, count in enumerate(timing.buckets):
+                cumulative += count
+                le = repr(BUCKETS[iBucket]) if iBucket < len(BUCKETS) else '+Inf'
+                lines.append(prefix + base + '_bucket{' + labels + separator + 'le="' + le + '"} ' +
+                             str(cumulative))
+            suffix = '{' + labels + '}' if labels else ''
+            lines.append(prefix + base + '_sum' + suffix + ' ' + repr(timing.total))
+            lines.append(prefix + base + '_count' + suffix + ' ' + str(timing.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+async def sample_loop_lag(interval: float = 0.5):
+    """Records how late the event loop wakes from a sleep, which is how long
+    something else held it."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe('loop_lag', max(0.0, time.perf_counter() - start - interval))
+
+
+metrics = Metrics()
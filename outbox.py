@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+import discord
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 2048
+
+
+def split_message(content: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Splits content into pieces no longer than limit, preferring to break
+    between lines."""
+    chunks = []
+    while len(content) > limit:
+        cut = content.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            chunks.append(content[:limit])
+            content = content[limit:]
+        else:
+            chunks.append(content[:cut])
+            content = content[cut + 1:]
+    if content:
+        chunks.append(content)
+    return chunks
+
+
+class ChannelOutbox:
+    def __init__(self, channel: discord.abc.Messageable, max_pending: int):
+        self.channel = channel
+        # Each entry is the message, its embed or file (if any) and the time
+        # it was queued.
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self.task: asyncio.Task = None
+
+
+class Outbox:
+    """Queues the bot's replies per channel. While one send to a channel is in
+    flight (or waiting out a rate limit), later replies to that channel build
+    up and go out together as a single message. Embeds and files are sent on
+    their own, in order with the text around them."""
+
+    def __init__(self, max_pending: int = 50, limit: int = MESSAGE_LIMIT):
+        self.max_pending = max_pending
+        self.limit = limit
+        self._channels: Dict[int, ChannelOutbox] = {}
+        self._depth = 0
+
+    async def send(self, channel: discord.abc.Messageable, content: str = None, embed: discord.Embed = None,
+                   file: discord.File = None):
+        """Queues a message for the channel. Waits if the channel already has
+        max_pending messages queued."""
+        if embed is not None or file is not None:
+            await self.__queue(channel, (content, {'embed': embed, 'file': file}, time.perf_counter()))
+            return
+        if content is None or content == '':
+            return
+
+        for chunk in split_message(str(content), self.limit):
+            await self.__queue(channel, (chunk, None, time.perf_counter()))
+
+    async def __queue(self, channel: discord.abc.Messageable, item: Tuple[str, dict, float]):
+        outbox = self._channels.get(channel.id)
+        if outbox is None:
+            outbox = self._channels[channel.id] = ChannelOutbox(channel, self.max_pending)
+
+        await outbox.queue.put(item)
+        self._depth += 1
+        metrics.increment('outbox_queued')
+        metrics.gauge('outbox_depth', self._depth)
+
+        if outbox.task is None or outbox.task.done():
+            outbox.task = asyncio.ensure_future(self.__drain(outbox))
+
+    async def close(self):
+        """Waits for every queued message to be sent."""
+        tasks = [outbox.task for outbox in self._channels.values()
+                 if outbox.task is not None and not outbox.task.done()]
+        if len(tasks) > 0:
+            # Drains cancelled at shutdown are skipped rather than raised.
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __drain(self, outbox: ChannelOutbox):
+        held: Tuple[str, dict, float] = None
+        while held is not None or not outbox.queue.empty():
+            if held is None:
+                held = outbox.queue.get_nowait()
+
+            # Take as many queued messages as fit in one Discord message.
+            content, attachments, queued_at = held
+            batch = [queued_at]
+            held = None
+            while attachments is None and not outbox.queue.empty():
+                item = outbox.queue.get_nowait()
+                if item[1] is not None or len(content) + 1 + len(item[0]) > self.limit:
+                    held = item
+                    break
+                content += '\n' + item[0]
+                batch.append(item[2])
+
+            self._depth -= len(batch)
+            metrics.gauge('outbox_depth', self._depth)
+            await self.__sendBatch(outbox.channel, content, attachments, batch)
+
+    async def __sendBatch(self, channel: discord.abc.Messageable, content: str, attachments: dict,
+                          batch: List[float]):
+        start = time.perf_counter()
+        try:
+            await channel.send(content, **(attachments or {}))
+        except Exception as ex:
+            metrics.increment('outbox_failed', len(batch))
+            guild = getattr(channel, 'guild', None)
+            log.warning('Unable to send to channel: %s', ex,
+                        extra={'guild': guild.id if guild is not None else None, 'channel': channel.id,
+                               'sample': True})
+            return
+
+        sent = time.perf_counter()
+        metrics.observe('outbox_send', sent - start)
+        metrics.increment('outbox_sends')
+        metrics.increment('outbox_coalesced', len(batch) - 1)
+        for queued_at in batch:
+            metrics.observe('outbox_latency', sent - queued_at)
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+import discord
+
+from config.config_manager import BaseConfigManager
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class RejoinRekeyer:
+    """Gives the gate role back to registered members who rejoin a guild that
+    allows it. Joins are queued and handled by a fixed number of workers, so a
+    join wave can't flood the role API."""
+
+    def __init__(self, configMgr: BaseConfigManager, concurrency: int = 2, max_pending: int = 1000):
+        self.configManager = configMgr
+        self.concurrency = concurrency
+        # Each entry is the member and the time they were queued.
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self._workers: List[asyncio.Task] = []
+
+    async def memberJoined(self, member: discord.Member):
+        if member.bot or member.guild.id not in self.configManager.config_data:
+            return
+        gateData = self.configManager.getGateData(member.guild)
+        if not gateData.gate_enabled or not gateData.allow_rejoin:
+            return
+        if self.configManager.getForumAccount(member.guild, member) is None:
+            return
+
+        metrics.increment('rekey_queued')
+        await self.queue.put((member, time.perf_counter()))
+        metrics.gauge('rekey_depth', self.queue.qsize())
+
+    def start(self):
+        if len(self._workers) == 0:
+            self._workers = [asyncio.ensure_future(self.__worker()) for _ in range(self.concurrency)]
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    async def __worker(self):
+        while True:
+            member, queuedAt = await self.queue.get()
+            metrics.gauge('rekey_depth', self.queue.qsize())
+            try:
+                await self.__rekey(member)
+            except Exception as ex:
+                metrics.increment('rekey_failed')
+                log.warning('Unable to re-key member: %s', ex,
+                            extra={'guild': member.guild.id, 'member': member.id, 'sample': True})
+            else:
+                metrics.observe('rekey_latency', time.perf_counter() - queuedAt)
+
+    async def __rekey(self, member: discord.Member):
+        # Settings or the registration may have changed while the member was
+        # queued.
+        gateData = self.configManager.getGateData(member.guild)
+        gateRole = member.guild.get_role(gateData.key_role_id)
+        if not gateData.gate_enabled or not gateData.allow_rejoin or gateRole is None or gateRole in member.roles \
+                or self.configManager.getForumAccount(member.guild, member) is None:
+            metrics.increment('rekey_skipped')
+            return
+
+        await member.add_roles(gateRole, reason='Registered member rejoined')
+        metrics.increment('rekey_granted')
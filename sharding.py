@@ -0,0 +1,36 @@
+from typing import List, Optional
+
+
+def parse_shard_ids(text: str, shard_count: int) -> Optional[List[int]]:
+    """Parses a shard list such as '0-3,8'. Returns None for ''. Raises
+    ValueError if the list is malformed or shard_count doesn't cover it."""
+    if not text.strip():
+        return None
+    if shard_count < 1:
+        raise ValueError('shard_ids requires shard_count')
+    shard_ids = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    if len(shard_ids) == 0 or min(shard_ids) < 0 or max(shard_ids) >= shard_count:
+        raise ValueError('shards must be between 0 and ' + str(shard_count - 1))
+    return shard_ids
+
+
+def format_shard_ids(shard_ids: List[int]) -> str:
+    return str(shard_ids[0]) + '-' + str(shard_ids[-1]) if len(shard_ids) > 1 else str(shard_ids[0])
+
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    """Splits shards 0..shard_count-1 into contiguous ranges, one per worker."""
+    workers = max(1, min(workers, shard_count))
+    ranges = []
+    start = 0
+    for iWorker in range(workers):
+        size = shard_count // workers + (1 if iWorker < shard_count % workers else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges